@@ -0,0 +1,77 @@
+"""
+Бенчмарк: новый httpx.AsyncClient на каждый вызов против общего пула соединений.
+Поднимает mcp_server локально и гоняет запросы в заглушку /1c/turnover.
+Запуск:
+    python bench_http_client.py --calls 500 --concurrency 10
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+PORT = int(os.getenv("BENCH_PORT", "9100"))
+os.environ.setdefault("API_1C_BASE_URL", f"http://127.0.0.1:{PORT}/1c")
+
+import httpx
+import uvicorn
+
+import mcp_server
+
+PARAMS = {"account": "60", "periodStart": "01-01-2024", "periodEnd": "31-01-2024"}
+
+
+async def call_per_request_client():
+    """Старое поведение: соединение открывается заново на каждый вызов."""
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(f"{mcp_server.API_BASE_URL}/turnover", params=PARAMS)
+        resp.raise_for_status()
+        return resp.json()
+
+
+async def call_shared_client():
+    resp = await mcp_server.get_http_client().get(f"{mcp_server.API_BASE_URL}/turnover", params=PARAMS)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def run(call, calls: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with sem:
+            await call()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return calls / (time.perf_counter() - started)
+
+
+async def main(calls: int, concurrency: int):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    config = uvicorn.Config(mcp_server.app, host="127.0.0.1", port=PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    serve_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    try:
+        # прогрев
+        await run(call_shared_client, 20, concurrency)
+        before = await run(call_per_request_client, calls, concurrency)
+        after = await run(call_shared_client, calls, concurrency)
+        print(f"calls={calls} concurrency={concurrency}")
+        print(f"  клиент на каждый вызов: {before:8.1f} вызовов/с")
+        print(f"  общий пул соединений:   {after:8.1f} вызовов/с  (x{after / before:.2f})")
+    finally:
+        await mcp_server.close_http_client()
+        server.should_exit = True
+        await serve_task
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.concurrency))
@@ -1,24 +1,428 @@
-import httpx
-from typing import Annotated, List, Dict
+import asyncio
+import hashlib
+import json
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Annotated, AsyncIterator, List, Dict, Literal, Optional, Tuple, Union
 
+import httpx
+import pandas as pd
 from fastapi import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from pydantic import Field
 from mcp.server.fastmcp import FastMCP
 
+from turnover_store import TurnoverStore
+
+
+API_BASE_URL = os.getenv("API_1C_BASE_URL", "http://localhost:9000/1c")
 
-API_BASE_URL = "http://localhost:9000/1c"
+# === Настройки HTTP-клиента к 1C ===
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "60"))
+# HTTP/2 требует пакет h2: pip install "httpx[http2]"
+HTTP2 = os.getenv("HTTP2", "0") == "1"
 
 mcp = FastMCP("mcp_1c")
 
+# Общий на весь сервер клиент: keep-alive соединения переиспользуются между вызовами инструментов
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Вернуть общий пул соединений к 1C, создав его при первом обращении."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            http2=HTTP2,
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Клиент создаётся при старте сервера и закрывается при остановке."""
+    get_http_client()
+    try:
+        yield
+    finally:
+        await close_http_client()
+        close_turnover_store()
+
+
+# === План счетов: кеш с условной перепроверкой и индексы ===
+
+# Как долго план счетов считается свежим без перепроверки в 1C (секунды)
+PLAN_ACCOUNTS_TTL = float(os.getenv("PLAN_ACCOUNTS_TTL", "300"))
+PLAN_ACCOUNTS_FLAGS = ("Забалансовый", "Валютный", "Количественный")
+
+
+class PlanAccountsIndex:
+    """Индексы плана счетов: по коду, по иерархическому префиксу кода и по признакам."""
+
+    def __init__(self, accounts: List[Dict]):
+        self.accounts = accounts
+        self.by_code: Dict[str, Dict] = {}
+        # "60" -> [60, 60.01, 60.02, ...]; "60.01" -> [60.01, 60.01.1, ...]
+        self.by_prefix: Dict[str, List[Dict]] = {}
+        # ("Валютный", True) -> [...]
+        self.by_flag: Dict[Tuple[str, bool], List[Dict]] = {}
+        for acc in accounts:
+            code = acc["Код"]
+            self.by_code[code] = acc
+            parts = code.split(".")
+            for i in range(1, len(parts) + 1):
+                self.by_prefix.setdefault(".".join(parts[:i]), []).append(acc)
+            for flag in PLAN_ACCOUNTS_FLAGS:
+                self.by_flag.setdefault((flag, bool(acc.get(flag))), []).append(acc)
+
+    def find(self, code: Optional[str] = None, prefix: Optional[str] = None,
+             flags: Optional[Dict[str, bool]] = None) -> List[Dict]:
+        candidates: List[List[Dict]] = []
+        if code is not None:
+            acc = self.by_code.get(code)
+            candidates.append([acc] if acc else [])
+        if prefix is not None:
+            candidates.append(self.by_prefix.get(prefix.rstrip("."), []))
+        for flag, value in (flags or {}).items():
+            candidates.append(self.by_flag.get((flag, value), []))
+        if not candidates:
+            return list(self.accounts)
+        # пересекаем от самого короткого списка
+        candidates.sort(key=len)
+        result = candidates[0]
+        for other in candidates[1:]:
+            ids = {id(a) for a in other}
+            result = [a for a in result if id(a) in ids]
+        return result
+
+
+class PlanAccountsCache:
+    """План счетов в памяти сервера. По истечении PLAN_ACCOUNTS_TTL перепроверяется в 1C
+    условным запросом (If-None-Match / If-Modified-Since): при 304 индекс не перестраивается."""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.index: Optional[PlanAccountsIndex] = None
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> PlanAccountsIndex:
+        if self.index is not None and time.monotonic() - self.checked_at < self.ttl:
+            return self.index
+        # один запрос на перепроверку, остальные ждут его результата
+        async with self._lock:
+            if self.index is None or time.monotonic() - self.checked_at >= self.ttl:
+                await self._revalidate()
+            return self.index
+
+    async def _revalidate(self) -> None:
+        headers = {}
+        if self.index is not None:
+            if self.etag:
+                headers["If-None-Match"] = self.etag
+            if self.last_modified:
+                headers["If-Modified-Since"] = self.last_modified
+        resp = await get_http_client().get(f"{API_BASE_URL}/plan_accounts", headers=headers)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+            self.index = PlanAccountsIndex(resp.json())
+            self.etag = resp.headers.get("ETag")
+            self.last_modified = resp.headers.get("Last-Modified")
+        self.checked_at = time.monotonic()
+
+
+plan_accounts = PlanAccountsCache(PLAN_ACCOUNTS_TTL)
+
 
 @mcp.tool()
 async def get_accounts() -> List[Dict]:
     """Получение плана счетов из 1C."""
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{API_BASE_URL}/plan_accounts")
-        resp.raise_for_status()
-        return resp.json()
+    return (await plan_accounts.get()).accounts
+
+
+@mcp.tool()
+async def find_accounts(
+    code: Annotated[Optional[str], Field(description="Точный код счёта, например 60.01")] = None,
+    prefix: Annotated[Optional[str], Field(description="Код счёта вместе с субсчетами, например 60")] = None,
+    currency: Annotated[Optional[bool], Field(description="Признак «Валютный»")] = None,
+    off_balance: Annotated[Optional[bool], Field(description="Признак «Забалансовый»")] = None,
+    quantitative: Annotated[Optional[bool], Field(description="Признак «Количественный»")] = None,
+) -> List[Dict]:
+    """Найти счета в плане счетов по коду, коду с субсчетами и признакам.
+    Возвращает только подходящие счета — используй вместо get_accounts."""
+    flags = {
+        flag: value
+        for flag, value in zip(PLAN_ACCOUNTS_FLAGS, (off_balance, currency, quantitative))
+        if value is not None
+    }
+    return (await plan_accounts.get()).find(code=code, prefix=prefix, flags=flags)
+
+
+# === Обороты: общий запрос для get_debit / get_credit / get_turnover ===
+
+TURNOVER_CACHE_TTL = float(os.getenv("TURNOVER_CACHE_TTL", "60"))
+# Файл с оборотами по закрытым месяцам: они в 1C уже не меняются и кешируются навсегда
+TURNOVER_STORE_PATH = os.getenv("TURNOVER_STORE_PATH", "turnover_cache.db")
+# Сколько строк оборотов запрашивать у 1C за один HTTP-запрос
+TURNOVER_PAGE_SIZE = int(os.getenv("TURNOVER_PAGE_SIZE", "50000"))
+# По сколько строк собирать блок, когда 1C отвечает JSON-массивом строк
+TURNOVER_BLOCK_ROWS = int(os.getenv("TURNOVER_BLOCK_ROWS", "5000"))
+DATE_FORMAT = "%d-%m-%Y"
+
+# (account, periodStart, periodEnd) -> (момент истечения по time.monotonic(), обороты)
+_turnover_cache: Dict[Tuple[str, str, str], Tuple[float, pd.DataFrame]] = {}
+# Незавершённые запросы: одинаковые параллельные вызовы ждут один и тот же fetch
+_turnover_inflight: Dict[Tuple[str, str, str], asyncio.Future] = {}
+_turnover_store: Optional[TurnoverStore] = None
+
+# Строки оборотов за разные месяцы сводятся по этим полям
+TURNOVER_KEY_FIELDS = [
+    "СчетКод",
+    "Субконто1Представление",
+    "Субконто2Представление",
+    "Субконто3Представление",
+    "ОрганизацияПредставление",
+    "ВалютаНаименование",
+]
+TURNOVER_SUM_FIELDS = ["СуммаОборот", "СуммаОборотДт", "СуммаОборотКт"]
+OPENING_BALANCE_FIELDS = ["СуммаНачальныйОстаток", "СуммаНачальныйОстатокДт", "СуммаНачальныйОстатокКт"]
+CLOSING_BALANCE_FIELDS = ["СуммаКонечныйОстаток", "СуммаКонечныйОстатокДт", "СуммаКонечныйОстатокКт"]
+TURNOVER_AMOUNT_FIELDS = OPENING_BALANCE_FIELDS + TURNOVER_SUM_FIELDS + CLOSING_BALANCE_FIELDS
+TURNOVER_COLUMNS = TURNOVER_KEY_FIELDS + TURNOVER_AMOUNT_FIELDS
+
+
+def get_turnover_store() -> TurnoverStore:
+    global _turnover_store
+    if _turnover_store is None:
+        _turnover_store = TurnoverStore(TURNOVER_STORE_PATH)
+    return _turnover_store
+
+
+def close_turnover_store() -> None:
+    global _turnover_store
+    if _turnover_store is not None:
+        _turnover_store.close()
+        _turnover_store = None
+
+
+def split_months(period_start: str, period_end: str) -> List[Tuple[str, str]]:
+    """Разбить период dd-mm-yyyy на календарные месяцы (крайние месяцы могут быть неполными)."""
+    start = datetime.strptime(period_start, DATE_FORMAT).date()
+    end = datetime.strptime(period_end, DATE_FORMAT).date()
+    if start > end:
+        raise ValueError(f"Начало периода {period_start} позже конца {period_end}")
+    months = []
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        chunk_end = min(end, next_month - timedelta(days=1))
+        months.append((start.strftime(DATE_FORMAT), chunk_end.strftime(DATE_FORMAT)))
+        start = next_month
+    return months
+
+
+def _is_closed(period_end: str) -> bool:
+    """Период закрыт, если он целиком раньше текущего месяца."""
+    return datetime.strptime(period_end, DATE_FORMAT).date() < date.today().replace(day=1)
+
+
+def turnover_frame(columns: Union[Dict[str, list], List[Dict]]) -> pd.DataFrame:
+    """Колоночный ответ 1C {поле: [значения]} (или список строк [{поле: значение}]) -> DataFrame."""
+    df = pd.DataFrame(columns).reindex(columns=TURNOVER_COLUMNS)
+    df[TURNOVER_KEY_FIELDS] = df[TURNOVER_KEY_FIELDS].fillna("")
+    df[TURNOVER_AMOUNT_FIELDS] = df[TURNOVER_AMOUNT_FIELDS].fillna(0)
+    return df
+
+
+async def _iter_json_rows(chunks: AsyncIterator[str]) -> AsyncIterator[Dict]:
+    """Строки JSON-массива [{...}, {...}] по мере прихода текста. 1C отдаёт массив
+    с переносами внутри строк, поэтому он разбирается не построчно, а raw_decode
+    по буферу: недошедшая строка ждёт следующего куска, целиком ответ в памяти не держится."""
+    decoder = json.JSONDecoder()
+    buffer, pos, opened = "", 0, False
+    async for chunk in chunks:
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buffer) or buffer[pos] == "]":
+                break
+            if not opened:
+                if buffer[pos] != "[":
+                    raise ValueError(f"1C вернул не JSON-массив: {buffer[pos:pos + 100]!r}")
+                opened, pos = True, pos + 1
+                continue
+            try:
+                row, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                break  # строка пришла не целиком
+            yield row
+    tail = buffer[pos:].strip()
+    if tail != "]":
+        raise ValueError(f"Оборванный JSON-массив оборотов 1C: {tail[:100]!r}")
+
+
+async def iter_turnover_blocks(
+    account: str,
+    period_start: str,
+    period_end: str,
+    offset: int = 0,
+    limit: Optional[int] = None,
+    cursor: Optional[Dict] = None,
+) -> AsyncIterator[pd.DataFrame]:
+    """Обороты из 1C по блокам. Отчёт запрашивается страницами по TURNOVER_PAGE_SIZE строк,
+    каждая страница читается потоком: в памяти одновременно только один блок.
+    Формат определяется по Content-Type: NDJSON колоночных блоков (format=ndjson) читается
+    построчно, обычный ответ 1C — JSON-массив строк — разбирается по мере прихода и режется
+    на блоки по TURNOVER_BLOCK_ROWS строк.
+    В cursor["next_offset"] записывается X-Next-Offset последней страницы (None — строк больше нет)."""
+    if cursor is not None:
+        cursor["next_offset"] = None
+    stop = None if limit is None else offset + limit
+    while stop is None or offset < stop:
+        page_limit = TURNOVER_PAGE_SIZE if stop is None else min(TURNOVER_PAGE_SIZE, stop - offset)
+        params = {
+            "account": account,
+            "periodStart": period_start,
+            "periodEnd": period_end,
+            "format": "ndjson",
+            "offset": offset,
+            "limit": page_limit,
+        }
+        async with get_http_client().stream("GET", f"{API_BASE_URL}/turnover", params=params) as resp:
+            resp.raise_for_status()
+            if "ndjson" in resp.headers.get("Content-Type", ""):
+                async for line in resp.aiter_lines():
+                    if line:
+                        yield turnover_frame(json.loads(line))
+            else:
+                rows = []
+                async for row in _iter_json_rows(resp.aiter_text()):
+                    rows.append(row)
+                    if len(rows) >= TURNOVER_BLOCK_ROWS:
+                        yield turnover_frame(rows)
+                        rows = []
+                if rows:
+                    yield turnover_frame(rows)
+            next_offset = resp.headers.get("X-Next-Offset")
+        if cursor is not None:
+            cursor["next_offset"] = int(next_offset) if next_offset else None
+        if not next_offset:
+            return
+        offset = int(next_offset)
+
+
+async def _request_turnover(account: str, period_start: str, period_end: str) -> pd.DataFrame:
+    blocks = [block async for block in iter_turnover_blocks(account, period_start, period_end)]
+    if not blocks:
+        return turnover_frame({})
+    return pd.concat(blocks, ignore_index=True)
+
+
+async def _load_month(account: str, period_start: str, period_end: str) -> pd.DataFrame:
+    """Обороты за месяц: закрытые месяцы берутся с диска, открытый всегда запрашивается в 1C."""
+    closed = _is_closed(period_end)
+    if closed:
+        columns = get_turnover_store().get(account, period_start, period_end)
+        if columns is not None:
+            return turnover_frame(columns)
+    df = await _request_turnover(account, period_start, period_end)
+    if closed:
+        get_turnover_store().put(account, period_start, period_end, df.to_dict("list"))
+    return df
+
+
+def _on_turnover_done(key: Tuple[str, str, str], task: asyncio.Future) -> None:
+    _turnover_inflight.pop(key, None)
+    if task.cancelled() or task.exception() is not None:
+        return
+    now = time.monotonic()
+    for k in [k for k, (expires, _) in _turnover_cache.items() if expires <= now]:
+        del _turnover_cache[k]
+    _turnover_cache[key] = (now + TURNOVER_CACHE_TTL, task.result())
+
+
+async def _fetch_month(account: str, period_start: str, period_end: str) -> pd.DataFrame:
+    """Обороты за месяц с объединением одинаковых запросов и TTL-кешем."""
+    key = (account, period_start, period_end)
+    cached = _turnover_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    task = _turnover_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_month(*key))
+        _turnover_inflight[key] = task
+        task.add_done_callback(lambda t: _on_turnover_done(key, t))
+    # shield: отмена одного из ожидающих не должна отменять общий запрос
+    return await asyncio.shield(task)
+
+
+def merge_turnover(months: List[pd.DataFrame]) -> pd.DataFrame:
+    """Свести помесячные обороты в итог за период: обороты складываются,
+    начальный остаток берётся из первого месяца, конечный — из последнего."""
+    agg = {f: "first" for f in OPENING_BALANCE_FIELDS}
+    agg.update({f: "sum" for f in TURNOVER_SUM_FIELDS})
+    agg.update({f: "last" for f in CLOSING_BALANCE_FIELDS})
+    df = pd.concat(months, ignore_index=True)
+    return df.groupby(TURNOVER_KEY_FIELDS, sort=False, as_index=False).agg(agg)[TURNOVER_COLUMNS]
+
+
+async def fetch_turnover(account: str, period_start: str, period_end: str) -> pd.DataFrame:
+    """Обороты по счёту за период: месяцы запрашиваются параллельно и сводятся в итог."""
+    months = split_months(period_start, period_end)
+    parts = await asyncio.gather(*(_fetch_month(account, s, e) for s, e in months))
+    if len(parts) == 1:
+        return parts[0]
+    return merge_turnover(parts)
+
+
+def _analytics(df: pd.DataFrame) -> List[str]:
+    return [
+        ", ".join(filter(None, sub))
+        for sub in zip(df["Субконто1Представление"], df["Субконто2Представление"], df["Субконто3Представление"])
+    ]
+
+
+def _turnover_rows(df: pd.DataFrame) -> List[Dict]:
+    return pd.DataFrame({
+        "account": df["СчетКод"],
+        "analytics": _analytics(df),
+        "debit": df["СуммаОборотДт"],
+        "credit": df["СуммаОборотКт"],
+        "opening_balance_debit": df["СуммаНачальныйОстатокДт"],
+        "opening_balance_credit": df["СуммаНачальныйОстатокКт"],
+        "closing_balance_debit": df["СуммаКонечныйОстатокДт"],
+        "closing_balance_credit": df["СуммаКонечныйОстатокКт"],
+    }).to_dict("records")
+
+
+def _amount_rows(df: pd.DataFrame, column: str) -> List[Dict]:
+    return pd.DataFrame({
+        "account": df["СчетКод"],
+        "analytics": _analytics(df),
+        "amount": df[column],
+    }).to_dict("records")
 
 
 @mcp.tool()
@@ -28,20 +432,7 @@ async def get_debit(
     period_end: Annotated[str, Field(description="Дата конца периода dd-mm-yyyy")],
 ) -> List[Dict]:
     """Получить сумму дебетовых оборотов по счёту за указанный период."""
-    params = {"account": account, "periodStart": period_start, "periodEnd": period_end}
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{API_BASE_URL}/turnover", params=params)
-        resp.raise_for_status()
-        data = resp.json()
-    result = []
-    for row in data:
-        analytics = ", ".join(filter(None, [
-            row.get("Субконто1Представление"),
-            row.get("Субконто2Представление"),
-            row.get("Субконто3Представление"),
-        ]))
-        result.append({"account": row["СчетКод"], "analytics": analytics, "amount": row["СуммаОборотДт"]})
-    return result
+    return _amount_rows(await fetch_turnover(account, period_start, period_end), "СуммаОборотДт")
 
 
 @mcp.tool()
@@ -51,89 +442,338 @@ async def get_credit(
     period_end: Annotated[str, Field(description="Дата конца периода dd-mm-yyyy")],
 ) -> List[Dict]:
     """Получить сумму кредитовых оборотов по счёту за указанный период."""
-    params = {"account": account, "periodStart": period_start, "periodEnd": period_end}
-    async with httpx.AsyncClient() as client:
-        resp = await client.get(f"{API_BASE_URL}/turnover", params=params)
-        resp.raise_for_status()
-        data = resp.json()
-    result = []
-    for row in data:
-        analytics = ", ".join(filter(None, [
-            row.get("Субконто1Представление"),
-            row.get("Субконто2Представление"),
-            row.get("Субконто3Представление"),
-        ]))
-        result.append({"account": row["СчетКод"], "analytics": analytics, "amount": row["СуммаОборотКт"]})
-    return result
+    return _amount_rows(await fetch_turnover(account, period_start, period_end), "СуммаОборотКт")
+
+
+@mcp.tool()
+async def get_turnover(
+    account: Annotated[str, Field(description="Код счёта")],
+    period_start: Annotated[str, Field(description="Дата начала периода dd-mm-yyyy")],
+    period_end: Annotated[str, Field(description="Дата конца периода dd-mm-yyyy")],
+) -> List[Dict]:
+    """Получить дебетовые и кредитовые обороты, начальные и конечные остатки по счёту за период
+    одним запросом. Используй вместо пары get_debit + get_credit."""
+    return _turnover_rows(await fetch_turnover(account, period_start, period_end))
+
+
+# Допустимые группировки и показатели для aggregate_turnover
+TURNOVER_GROUP_FIELDS = {
+    "Субконто1": "Субконто1Представление",
+    "Субконто2": "Субконто2Представление",
+    "Субконто3": "Субконто3Представление",
+    "ОрганизацияПредставление": "ОрганизацияПредставление",
+    "ВалютаНаименование": "ВалютаНаименование",
+}
+TURNOVER_MEASURES = {"debit": "СуммаОборотДт", "credit": "СуммаОборотКт", "turnover": "СуммаОборот"}
+GroupField = Literal["Субконто1", "Субконто2", "Субконто3", "ОрганизацияПредставление", "ВалютаНаименование"]
+
+
+class TurnoverAggregator:
+    """Потоковая группировка оборотов: каждый блок сворачивается в суммы по группам,
+    так что память ограничена числом групп, а не числом строк отчёта."""
+
+    # после стольких частичных сумм они сворачиваются в одну
+    COMPACT_EVERY = 16
+
+    def __init__(self, group_by: List[str]):
+        self.group_by = group_by
+        self.columns = [TURNOVER_GROUP_FIELDS[g] for g in group_by]
+        self.rows = 0
+        self._parts: List[pd.DataFrame] = []
+
+    def add(self, block: pd.DataFrame) -> None:
+        self.rows += len(block)
+        self._parts.append(block.groupby(self.columns, sort=False)[TURNOVER_SUM_FIELDS].sum())
+        if len(self._parts) >= self.COMPACT_EVERY:
+            self._parts = [self._combine()]
+
+    def _combine(self) -> pd.DataFrame:
+        if not self._parts:
+            return turnover_frame({}).groupby(self.columns)[TURNOVER_SUM_FIELDS].sum()
+        if len(self._parts) == 1:
+            return self._parts[0]
+        levels = list(range(len(self.columns)))
+        return pd.concat(self._parts).groupby(level=levels, sort=False).sum()
+
+    def summary(self, measure: str, top_n: int) -> Dict:
+        """Итоги, top-N групп по показателю с долями; хвост сворачивается в строку «other»."""
+        measure_column = TURNOVER_MEASURES[measure]
+        sums = self._combine().sort_values(measure_column, ascending=False)
+        totals = sums.sum()
+        total = totals[measure_column]
+        shares = sums[measure_column] / total if total else sums[measure_column] * 0
+
+        top = sums.head(top_n).assign(share=shares.head(top_n).round(4)).reset_index()
+        top.columns = self.group_by + [
+            {v: k for k, v in TURNOVER_MEASURES.items()}.get(c, c) for c in top.columns[len(self.group_by):]
+        ]
+        rest = sums.iloc[top_n:]
+        return {
+            "group_by": self.group_by,
+            "measure": measure,
+            "rows": self.rows,
+            "groups": int(len(sums)),
+            "total": {k: float(totals[v]) for k, v in TURNOVER_MEASURES.items()},
+            "top": top.to_dict("records"),
+            "other": {
+                "groups": int(len(rest)),
+                **{k: float(rest[v].sum()) for k, v in TURNOVER_MEASURES.items()},
+                "share": round(float(shares.iloc[top_n:].sum()), 4),
+            },
+        }
+
+
+@mcp.tool()
+async def aggregate_turnover(
+    account: Annotated[str, Field(description="Код счёта")],
+    period_start: Annotated[str, Field(description="Дата начала периода dd-mm-yyyy")],
+    period_end: Annotated[str, Field(description="Дата конца периода dd-mm-yyyy")],
+    group_by: Annotated[List[GroupField], Field(description="Поля группировки", min_length=1)],
+    measure: Annotated[Literal["debit", "credit", "turnover"], Field(description="Показатель для сортировки и долей")] = "debit",
+    top_n: Annotated[int, Field(description="Сколько крупнейших групп вернуть", ge=1, le=100)] = 10,
+) -> Dict:
+    """Сводная таблица оборотов по счёту за период: суммы дебета/кредита по группам,
+    top-N групп по показателю и их доли от итога. Суммирование выполняется на сервере —
+    используй вместо ручного сложения строк из get_debit/get_credit."""
+    aggregator = TurnoverAggregator(group_by)
+    # обороты аддитивны, поэтому отчёт за весь период читается одним потоком без разбиения по месяцам
+    async for block in iter_turnover_blocks(account, period_start, period_end):
+        aggregator.add(block)
+    return {"account": account, **aggregator.summary(measure, top_n)}
+
+
+@mcp.tool()
+async def get_turnover_page(
+    account: Annotated[str, Field(description="Код счёта")],
+    period_start: Annotated[str, Field(description="Дата начала периода dd-mm-yyyy")],
+    period_end: Annotated[str, Field(description="Дата конца периода dd-mm-yyyy")],
+    offset: Annotated[int, Field(description="С какой строки отчёта начать", ge=0)] = 0,
+    limit: Annotated[int, Field(description="Сколько строк вернуть", ge=1, le=1000)] = 100,
+) -> Dict:
+    """Получить одну страницу строк оборотов по счёту за период (для больших отчётов).
+    next_offset — смещение следующей страницы или null, если строк больше нет."""
+    cursor: Dict = {}
+    blocks = [
+        block async for block in iter_turnover_blocks(account, period_start, period_end, offset, limit, cursor)
+    ]
+    df = pd.concat(blocks, ignore_index=True) if blocks else turnover_frame({})
+    return {
+        "offset": offset,
+        "rows": _turnover_rows(df),
+        # по заголовку 1C, а не по len(df) == limit: отчёт может кончиться ровно на границе страницы
+        "next_offset": cursor["next_offset"],
+    }
+
+
+TURNOVER_BATCH_CONCURRENCY = int(os.getenv("TURNOVER_BATCH_CONCURRENCY", "8"))
+# Ограничивает число одновременных запросов оборотов в 1C от пакетных вызовов
+_turnover_batch_sem = asyncio.Semaphore(TURNOVER_BATCH_CONCURRENCY)
+
+
+@mcp.tool()
+async def get_turnover_batch(
+    accounts: Annotated[List[str], Field(description="Список кодов счетов")],
+    period_start: Annotated[str, Field(description="Дата начала периода dd-mm-yyyy")],
+    period_end: Annotated[str, Field(description="Дата конца периода dd-mm-yyyy")],
+) -> List[Dict]:
+    """Получить обороты и остатки сразу по нескольким счетам за период одним вызовом.
+    Для каждого счёта возвращается {"account", "rows"} либо {"account", "error"}, если запрос
+    по этому счёту не удался. Неверный период — общая ошибка всего вызова."""
+    # период общий для всех счетов: проверяем его один раз, до запросов в 1C
+    split_months(period_start, period_end)
+
+    async def one(account: str) -> Dict:
+        # любая ошибка одного счёта (HTTP, разбор ответа 1C, кеш на диске) не роняет остальные
+        try:
+            async with _turnover_batch_sem:
+                df = await fetch_turnover(account, period_start, period_end)
+        except Exception as e:
+            return {"account": account, "error": f"{type(e).__name__}: {e}"}
+        return {"account": account, "rows": _turnover_rows(df)}
+
+    # dict.fromkeys убирает повторы, сохраняя порядок
+    return await asyncio.gather(*(one(a) for a in dict.fromkeys(accounts)))
 
 
 # Dummy 1C API
+PLAN_ACCOUNTS = [
+    {
+        "Код": "50",
+        "Наименование": "Касса",
+        "Представление": "Активный",
+        "Забалансовый": False,
+        "Валютный": False,
+        "Количественный": False,
+    },
+    {
+        "Код": "51",
+        "Наименование": "Расчётные счета",
+        "Представление": "Активный",
+        "Забалансовый": False,
+        "Валютный": True,
+        "Количественный": False,
+    },
+    {
+        "Код": "60",
+        "Наименование": "Расчеты с поставщиками и подрядчиками",
+        "Представление": "Активно-пассивный",
+        "Забалансовый": False,
+        "Валютный": False,
+        "Количественный": False,
+    },
+    {
+        "Код": "60.01",
+        "Наименование": "Расчеты с поставщиками и подрядчиками",
+        "Представление": "Пассивный",
+        "Забалансовый": False,
+        "Валютный": False,
+        "Количественный": False,
+    },
+    {
+        "Код": "60.21",
+        "Наименование": "Расчеты с поставщиками и подрядчиками (в валюте)",
+        "Представление": "Пассивный",
+        "Забалансовый": False,
+        "Валютный": True,
+        "Количественный": False,
+    },
+    {
+        "Код": "001",
+        "Наименование": "Арендованные основные средства",
+        "Представление": "Активный",
+        "Забалансовый": True,
+        "Валютный": False,
+        "Количественный": False,
+    },
+]
+PLAN_ACCOUNTS_ETAG = '"%s"' % hashlib.sha1(
+    json.dumps(PLAN_ACCOUNTS, ensure_ascii=False, sort_keys=True).encode()
+).hexdigest()
+PLAN_ACCOUNTS_LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
 @mcp.custom_route("/1c/plan_accounts", methods=["GET"])
 async def dummy_plan_accounts(request: Request):
-    """Заглушка для получения плана счетов."""
-    data = [
-        {
-            "Код": "50",
-            "Наименование": "Касса",
-            "Представление": "Активный",
-            "Забалансовый": False,
-            "Валютный": False,
-            "Количественный": False,
-        },
-        {
-            "Код": "51",
-            "Наименование": "Расчётные счета",
-            "Представление": "Активный",
-            "Забалансовый": False,
-            "Валютный": True,
-            "Количественный": False,
-        },
-    ]
-    return JSONResponse(data)
+    """Заглушка для получения плана счетов. Поддерживает условные запросы (ETag / Last-Modified)."""
+    headers = {"ETag": PLAN_ACCOUNTS_ETAG, "Last-Modified": PLAN_ACCOUNTS_LAST_MODIFIED}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match == PLAN_ACCOUNTS_ETAG:
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since") == PLAN_ACCOUNTS_LAST_MODIFIED:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(PLAN_ACCOUNTS, headers=headers)
+
+
+# Размер синтетического отчёта заглушки для нагрузочных тестов (0 — две фиксированные строки)
+DUMMY_TURNOVER_ROWS = int(os.getenv("DUMMY_TURNOVER_ROWS", "0"))
+DUMMY_TURNOVER_BLOCK = 1000
+
+DUMMY_TURNOVER_ROWS_FIXED = [
+    {
+        "Субконто1Представление": "Контрагент А",
+        "Субконто2Представление": "Договор 1",
+        "Субконто3Представление": "",
+        "ОрганизацияПредставление": "ООО \"Ромашка\"",
+        "ВалютаНаименование": "руб.",
+        "СуммаНачальныйОстаток": 0,
+        "СуммаНачальныйОстатокДт": 0,
+        "СуммаНачальныйОстатокКт": 0,
+        "СуммаКонечныйОстаток": 1000,
+        "СуммаКонечныйОстатокДт": 1000,
+        "СуммаКонечныйОстатокКт": 0,
+        "СуммаОборот": 1000,
+        "СуммаОборотДт": 1000,
+        "СуммаОборотКт": 0,
+    },
+    {
+        "Субконто1Представление": "Контрагент Б",
+        "Субконто2Представление": "Договор 2",
+        "Субконто3Представление": "",
+        "ОрганизацияПредставление": "ООО \"Ромашка\"",
+        "ВалютаНаименование": "руб.",
+        "СуммаНачальныйОстаток": 0,
+        "СуммаНачальныйОстатокДт": 0,
+        "СуммаНачальныйОстатокКт": 0,
+        "СуммаКонечныйОстаток": 2000,
+        "СуммаКонечныйОстатокДт": 0,
+        "СуммаКонечныйОстатокКт": 2000,
+        "СуммаОборот": 2000,
+        "СуммаОборотДт": 0,
+        "СуммаОборотКт": 2000,
+    },
+]
+
+
+def _dummy_turnover_columns(account: str, start: int, stop: int) -> Dict[str, list]:
+    """Строки [start, stop) синтетического отчёта в колоночном виде; генерируются по номеру строки."""
+    idx = range(start, stop)
+    debit = [(i * 7919) % 100_000 for i in idx]
+    credit = [(i * 104_729) % 100_000 for i in idx]
+    closing = [d - c for d, c in zip(debit, credit)]
+    return {
+        "СчетКод": [account] * len(idx),
+        "Субконто1Представление": [f"Контрагент {i % 5000}" for i in idx],
+        "Субконто2Представление": [f"Договор {i}" for i in idx],
+        "Субконто3Представление": [""] * len(idx),
+        "ОрганизацияПредставление": [("ООО \"Ромашка\"", "ООО \"Лютик\"")[i % 2] for i in idx],
+        "ВалютаНаименование": [("руб.", "USD", "EUR")[i % 3] for i in idx],
+        "СуммаНачальныйОстаток": [0] * len(idx),
+        "СуммаНачальныйОстатокДт": [0] * len(idx),
+        "СуммаНачальныйОстатокКт": [0] * len(idx),
+        "СуммаКонечныйОстаток": closing,
+        "СуммаКонечныйОстатокДт": [max(x, 0) for x in closing],
+        "СуммаКонечныйОстатокКт": [max(-x, 0) for x in closing],
+        "СуммаОборот": [d + c for d, c in zip(debit, credit)],
+        "СуммаОборотДт": debit,
+        "СуммаОборотКт": credit,
+    }
+
+
+def _dummy_fixed_columns(account: str, start: int, stop: int) -> Dict[str, list]:
+    rows = DUMMY_TURNOVER_ROWS_FIXED[start:stop]
+    return {f: [account if f == "СчетКод" else row[f] for row in rows] for f in TURNOVER_COLUMNS}
 
 
 @mcp.custom_route("/1c/turnover", methods=["GET"])
 async def dummy_turnover(request: Request):
-    """Заглушка для получения оборотов по счёту."""
-    account = request.query_params.get("account", "50")
-    data = [
-        {
-            "СчетКод": account,
-            "Субконто1Представление": "Контрагент А",
-            "Субконто2Представление": "Договор 1",
-            "Субконто3Представление": "",
-            "ОрганизацияПредставление": "ООО \"Ромашка\"",
-            "ВалютаНаименование": "руб.",
-            "СуммаНачальныйОстаток": 0,
-            "СуммаНачальныйОстатокДт": 0,
-            "СуммаНачальныйОстатокКт": 0,
-            "СуммаКонечныйОстаток": 1000,
-            "СуммаКонечныйОстатокДт": 1000,
-            "СуммаКонечныйОстатокКт": 0,
-            "СуммаОборот": 1000,
-            "СуммаОборотДт": 1000,
-            "СуммаОборотКт": 0,
-        },
-        {
-            "СчетКод": account,
-            "Субконто1Представление": "Контрагент Б",
-            "Субконто2Представление": "Договор 2",
-            "Субконто3Представление": "",
-            "ОрганизацияПредставление": "ООО \"Ромашка\"",
-            "ВалютаНаименование": "руб.",
-            "СуммаНачальныйОстаток": 0,
-            "СуммаНачальныйОстатокДт": 0,
-            "СуммаНачальныйОстатокКт": 0,
-            "СуммаКонечныйОстаток": 2000,
-            "СуммаКонечныйОстатокДт": 0,
-            "СуммаКонечныйОстатокКт": 2000,
-            "СуммаОборот": 2000,
-            "СуммаОборотДт": 0,
-            "СуммаОборотКт": 2000,
-        },
-    ]
-    return JSONResponse(data)
+    """Заглушка для получения оборотов по счёту.
+    offset/limit — страница отчёта, следующая страница передаётся в заголовке X-Next-Offset;
+    rows — размер синтетического отчёта (по умолчанию DUMMY_TURNOVER_ROWS);
+    format=columns — колоночный ответ {поле: [значения]}, format=ndjson — поток колоночных блоков."""
+    params = request.query_params
+    account = params.get("account", "50")
+    total = int(params.get("rows", DUMMY_TURNOVER_ROWS))
+    columns = _dummy_turnover_columns if total else _dummy_fixed_columns
+    if not total:
+        total = len(DUMMY_TURNOVER_ROWS_FIXED)
+    offset = min(int(params.get("offset", 0)), total)
+    stop = total if params.get("limit") is None else min(total, offset + int(params["limit"]))
+
+    headers = {"X-Total-Count": str(total)}
+    if stop < total:
+        headers["X-Next-Offset"] = str(stop)
+
+    fmt = params.get("format")
+    if fmt == "ndjson":
+        def blocks():
+            for start in range(offset, stop, DUMMY_TURNOVER_BLOCK):
+                block = columns(account, start, min(stop, start + DUMMY_TURNOVER_BLOCK))
+                yield json.dumps(block, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(blocks(), media_type="application/x-ndjson", headers=headers)
+    data = columns(account, offset, stop)
+    if fmt == "columns":
+        return JSONResponse(data, headers=headers)
+    return JSONResponse([dict(zip(data, values)) for values in zip(*data.values())], headers=headers)
+
+
+# SSE-приложение собирается после регистрации всех маршрутов; запуск: uvicorn mcp_server:app
+app = mcp.sse_app()
+app.router.lifespan_context = lifespan
 
 
 if __name__ == "__main__":
-    mcp.run(transport="sse")
+    import uvicorn
+
+    uvicorn.run(app, host=mcp.settings.host, port=mcp.settings.port)
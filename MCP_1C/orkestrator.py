@@ -3,8 +3,12 @@ SearchAgent объединяет vLLM-чат и MCP-поиск.
 Использование:
     async with SearchAgent("web_search/server.py") as bot:
         answer = await bot.ask("Привет, мир!")
+
+Один агент обслуживает много пользователей сразу: ask() можно вызывать конкурентно,
+история сообщений и бюджет у каждого вызова свои, а MCP-сессии (mcp_sessions штук)
+и кеш инструментов общие — соединение и list_tools делаются один раз на весь сервис.
 """
-import json, asyncio
+import json, asyncio, time
 from openai import AsyncOpenAI
 from fastmcp import Client as MCP
 
@@ -21,47 +25,175 @@ def _mcp_to_openai(tools):
     } for t in tools]
 
 
+def _tool_content(result) -> str:
+    """
+    Результат инструмента → content tool-сообщения. Новые версии fastmcp возвращают
+    CallToolResult, старые — список content; инструмент, вернувший None, даёт пустой content —
+    тогда берётся structured_content.
+    """
+    blocks = getattr(result, "content", result) or []
+    texts = [block.text for block in blocks if getattr(block, "text", None) is not None]
+    if texts:
+        return json.dumps("\n".join(texts))
+    return json.dumps(getattr(result, "structured_content", None), ensure_ascii=False)
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason  # max_turns, deadline или max_tokens
+
+
+class AskBudget:
+    """Бюджет одного ask: ходы модели, время с начала запроса и токены по usage; 0 — без ограничения."""
+
+    def __init__(self, max_turns: int, deadline: float, max_tokens: int):
+        self.max_turns = max_turns
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.started = time.monotonic()
+        self.turns = 0
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.last_content = ""  # последний текст модели — частичный ответ, если бюджет кончится
+
+    def remaining_time(self) -> float | None:
+        return max(0.0, self.deadline - (time.monotonic() - self.started)) if self.deadline else None
+
+    def limits(self) -> dict:
+        """max_tokens для следующего хода модели, чтобы она не вышла за остаток бюджета."""
+        if not self.max_tokens:
+            return {}
+        return {"max_tokens": max(1, self.max_tokens - self.prompt_tokens - self.completion_tokens)}
+
+    def check(self) -> None:
+        if self.max_turns and self.turns >= self.max_turns:
+            raise BudgetExceeded("max_turns")
+        if self.deadline and self.remaining_time() <= 0:
+            raise BudgetExceeded("deadline")
+        if self.max_tokens and self.prompt_tokens + self.completion_tokens >= self.max_tokens:
+            raise BudgetExceeded("max_tokens")
+
+    async def wait(self, awaitable):
+        """Ждёт не дольше оставшегося времени; по истечении awaitable отменяется."""
+        try:
+            return await asyncio.wait_for(awaitable, self.remaining_time())
+        except asyncio.TimeoutError:
+            raise BudgetExceeded("deadline")
+
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "max_turns": self.max_turns,
+            "tool_calls": self.tool_calls,
+            "elapsed": round(time.monotonic() - self.started, 3),
+            "deadline": self.deadline,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens,
+            "max_tokens": self.max_tokens,
+        }
+
+
 class SearchAgent:
     def __init__(
             self,
             mcp_cmd: str,
             llm_url: str = "http://localhost:8000/v1",
-            model: str = "Salesforce/xLAM-2-32b-fc-r"
+            model: str = "Salesforce/xLAM-2-32b-fc-r",
+            max_turns: int = 20,
+            deadline: float = 600,
+            max_tokens: int = 0,
+            tool_timeout: float = 120,
+            max_parallel_tools: int = 4,
+            tool_limits: dict[str, int] | None = None,
+            mcp_sessions: int = 1,
     ):
         self.mcp = MCP(mcp_cmd)
+        # пул MCP-сессий: вызовы инструментов конкурентных ask() распределяются по наименее занятой
+        self.sessions = [self.mcp] + [MCP(mcp_cmd) for _ in range(mcp_sessions - 1)]
+        self._session_load = [0] * len(self.sessions)
         self.llm = AsyncOpenAI(base_url=llm_url, api_key="dummy")
         self.model = model
         self.tools = None  # кеш описания инструментов
+        # бюджет одного ask по умолчанию: ходов модели, секунд и токенов (0 — без ограничения)
+        self.max_turns = max_turns
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        # вызовы инструментов одного хода идут параллельно: не дольше tool_timeout каждый,
+        # не больше tool_limits[имя] (или max_parallel_tools) одновременных вызовов одного инструмента
+        self.tool_timeout = tool_timeout
+        self.max_parallel_tools = max_parallel_tools
+        self.tool_limits = tool_limits or {}
+        self._tool_semaphores: dict[str, asyncio.Semaphore] = {}
 
     async def __aenter__(self):
-        await self.mcp.__aenter__()
+        await asyncio.gather(*(session.__aenter__() for session in self.sessions))
         await self.llm.__aenter__()
         self.tools = _mcp_to_openai(await self.mcp.list_tools())
         return self
 
     async def __aexit__(self, *exc):
-        await self.mcp.__aexit__(*exc)
+        for session in self.sessions:
+            await session.__aexit__(*exc)
         await self.llm.__aexit__(*exc)
 
-    async def ask(self, prompt: str, system: str | None = None) -> str:
-        """Отправляет один запрос LLM, автоматически обслуживая tool-calls."""
+    async def ask(self, prompt: str, system: str | None = None, **budget) -> str:
+        """Отправляет один запрос LLM, автоматически обслуживая tool-calls.
+        budget — max_turns / deadline / max_tokens, см. ask_with_stats."""
+        return (await self.ask_with_stats(prompt, system, **budget))["answer"]
+
+    async def ask_with_stats(
+            self,
+            prompt: str,
+            system: str | None = None,
+            max_turns: int | None = None,
+            deadline: float | None = None,
+            max_tokens: int | None = None,
+    ) -> dict:
+        """
+        То же, что ask, но в пределах бюджета (по умолчанию — из конструктора).
+        Возвращает {"answer", "stop_reason", "usage"}: stop_reason — finished или исчерпанный
+        бюджет (max_turns / deadline / max_tokens), тогда answer — последний текст модели,
+        а незавершённый вызов инструмента отменяется.
+        """
+        budget = AskBudget(
+            self.max_turns if max_turns is None else max_turns,
+            self.deadline if deadline is None else deadline,
+            self.max_tokens if max_tokens is None else max_tokens,
+        )
+        try:
+            answer = await self._ask(prompt, system, budget)
+            stop_reason = "finished"
+        except BudgetExceeded as e:
+            answer = budget.last_content
+            stop_reason = e.reason
+        return {"answer": answer, "stop_reason": stop_reason, "usage": budget.stats()}
+
+    async def _ask(self, prompt: str, system: str | None, budget: AskBudget) -> str:
         msgs = []
         if system:
             msgs.append({"role": "system", "content": system})
         msgs.append({"role": "user", "content": prompt})
 
         while True:
+            budget.check()
+            budget.turns += 1
             resp = ''
             try:
-                resp = await self.llm.chat.completions.create(
+                resp = await budget.wait(self.llm.chat.completions.create(
                     model=self.model,
                     messages=msgs,
                     tools=self.tools,
                     tool_choice="auto",
                     extra_body={
                         "min_tokens": 5
-                    }
-                )
+                    },
+                    **budget.limits()
+                ))
+            except BudgetExceeded:
+                raise
             except Exception as e:
                 id = msgs[-1]['tool_call_id']
                 content = msgs[-1]['content']
@@ -74,22 +206,65 @@ class SearchAgent:
 
             if not resp:
                 continue
+            if resp.usage:
+                budget.prompt_tokens += resp.usage.prompt_tokens
+                budget.completion_tokens += resp.usage.completion_tokens
             msg = resp.choices[0].message
+            budget.last_content = msg.content or budget.last_content
 
             if msg.tool_calls:
-                for call in msg.tool_calls:
-                    args = json.loads(call.function.arguments)
-                    result = await self.mcp.call_tool(call.function.name, args)
+                # на ответ по результатам инструментов бюджета уже не хватит — не вызываем их
+                budget.check()
+                budget.tool_calls += len(msg.tool_calls)
+                msgs.append({
+                    "role": "assistant",
+                    "content": msg.content,
+                    "tool_calls": [
+                        {"id": call.id, "type": "function",
+                         "function": {"name": call.function.name, "arguments": call.function.arguments}}
+                        for call in msg.tool_calls
+                    ],
+                })
+                # все вызовы хода сразу; по deadline незавершённые отменяются вместе с gather
+                contents = await budget.wait(asyncio.gather(*(self._call_tool(call) for call in msg.tool_calls)))
+                for call, content in zip(msg.tool_calls, contents):
                     msgs.append({
                         "role": "tool",
                         "tool_call_id": call.id,
-                        "content": json.dumps(result[0].text)
+                        "content": content
                     })
-                    print("function_called", result)
                 continue
-            if '</Finished>' not in msg.content:
+            if '</Finished>' not in (msg.content or ''):
                 msgs.append(
                     {"role": "user", "content": "Дай конечный результат с тегом </Finished>, "
                                                 "если ты закончил вызов инструментов."})
                 continue
             return msg.content
+
+    def _tool_semaphore(self, name: str) -> asyncio.Semaphore:
+        if name not in self._tool_semaphores:
+            self._tool_semaphores[name] = asyncio.Semaphore(self.tool_limits.get(name, self.max_parallel_tools))
+        return self._tool_semaphores[name]
+
+    async def _call_tool(self, call) -> str:
+        """
+        Один вызов инструмента → содержимое tool-сообщения. Ошибка или таймаут одного вызова
+        не прерывают остальные: модель получает текст ошибки вместо результата.
+        """
+        name = call.function.name
+        i = min(range(len(self.sessions)), key=self._session_load.__getitem__)
+        self._session_load[i] += 1
+        try:
+            args = json.loads(call.function.arguments or "{}")
+            async with self._tool_semaphore(name):
+                result = await asyncio.wait_for(self.sessions[i].call_tool(name, args), self.tool_timeout)
+            print("function_called", result)
+            return _tool_content(result)
+        except asyncio.TimeoutError:
+            print("function_timeout", name)
+            return json.dumps(f"Ошибка: инструмент {name} не ответил за {self.tool_timeout} с")
+        except Exception as e:
+            print("function_failed", name, e)
+            return json.dumps(f"Ошибка инструмента {name}: {e}")
+        finally:
+            self._session_load[i] -= 1
@@ -0,0 +1,46 @@
+"""Локальное хранилище оборотов по закрытым месяцам.
+
+Обороты за закрытый период в 1C уже не меняются, поэтому они сохраняются
+на диск один раз и дальше читаются отсюда без обращения к 1C.
+"""
+import json
+import sqlite3
+from typing import Dict, List, Optional
+
+
+class TurnoverStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS month_turnover_columns (
+                account      TEXT NOT NULL,
+                period_start TEXT NOT NULL,
+                period_end   TEXT NOT NULL,
+                data         TEXT NOT NULL,
+                PRIMARY KEY (account, period_start, period_end)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, account: str, period_start: str, period_end: str) -> Optional[Dict[str, List]]:
+        """Обороты месяца в колоночном виде {поле: [значения]} или None, если месяца нет."""
+        row = self._conn.execute(
+            "SELECT data FROM month_turnover_columns WHERE account = ? AND period_start = ? AND period_end = ?",
+            (account, period_start, period_end),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, account: str, period_start: str, period_end: str, columns: Dict[str, List]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO month_turnover_columns (account, period_start, period_end, data) "
+            "VALUES (?, ?, ?, ?)",
+            (account, period_start, period_end, json.dumps(columns, ensure_ascii=False)),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,124 @@
+"""
+Бенчмарк: конкурентные ask() к SearchAgent.
+Поднимает заглушку vLLM (первый ход — вызов инструмента, второй — ответ с </Finished>)
+и MCP-сервер с инструментом lookup, затем сравнивает:
+  - агент на каждый запрос: своё SSE-соединение и list_tools на каждого пользователя;
+  - один общий агент на всех: одна MCP-сессия или пул из --sessions сессий.
+Запуск:
+    python bench_agent.py --asks 100 --users 20 --sessions 4
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+MOCK_PORT = int(os.getenv("BENCH_MOCK_PORT", "9220"))
+MCP_PORT = int(os.getenv("BENCH_MCP_PORT", "9221"))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from mcp.server.fastmcp import FastMCP
+
+from orchestrator_agent import SearchAgent
+
+LLM_DELAY = 0.05
+TOOL_DELAY = 0.02
+
+mock = FastAPI()
+tools_server = FastMCP("bench")
+
+
+@tools_server.tool()
+async def lookup(query: str) -> str:
+    """Найти справку по запросу."""
+    await asyncio.sleep(TOOL_DELAY)
+    return f"справка: {query}"
+
+
+def completion(message: dict, finish_reason: str) -> dict:
+    return {
+        "id": "bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "bench",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+@mock.post("/v1/chat/completions")
+async def mock_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(LLM_DELAY)
+    if any(m["role"] == "tool" for m in body["messages"]):
+        return completion({"role": "assistant", "content": "42 </Finished>"}, "stop")
+    args = json.dumps({"query": body["messages"][-1]["content"]})
+    call = {"id": "call_0", "type": "function", "function": {"name": "lookup", "arguments": args}}
+    return completion({"role": "assistant", "content": None, "tool_calls": [call]}, "tool_calls")
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+MCP_URL = f"http://127.0.0.1:{MCP_PORT}/sse"
+LLM_URL = f"http://127.0.0.1:{MOCK_PORT}/v1"
+
+
+async def run(ask, asks: int, users: int) -> float:
+    sem = asyncio.Semaphore(users)
+
+    async def one(i: int):
+        async with sem:
+            answer = await ask(f"вопрос {i}")
+            assert "42" in answer, answer
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(asks)))
+    return asks / (time.perf_counter() - started)
+
+
+async def agent_per_ask(prompt: str) -> str:
+    """Прежняя схема: новый агент, соединение и list_tools на каждый запрос."""
+    async with SearchAgent(MCP_server_url=MCP_URL, llm_url=LLM_URL) as bot:
+        return await bot.ask(prompt)
+
+
+async def main(asks: int, users: int, sessions: int):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("mcp").setLevel(logging.WARNING)
+    servers = [serve_in_thread(mock, MOCK_PORT), serve_in_thread(tools_server.sse_app(), MCP_PORT)]
+    results = {}
+    # SearchAgent печатает каждый вызов инструмента — в бенчмарке это шум
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["агент на каждый запрос"] = await run(agent_per_ask, asks, users)
+        for n in sorted({1, sessions}):
+            async with SearchAgent(MCP_server_url=MCP_URL, llm_url=LLM_URL, mcp_sessions=n) as bot:
+                await run(bot.ask, users, users)  # прогрев
+                results[f"общий агент, MCP-сессий: {n}"] = await run(bot.ask, asks, users)
+    print(f"asks={asks} users={users} llm_delay={LLM_DELAY}s tool_delay={TOOL_DELAY}s")
+    for name, rate in results.items():
+        print(f"  {name:32} {rate:8.1f} ask/с")
+    for server in servers:
+        server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--asks", type=int, default=100)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--llm-delay", type=float, default=LLM_DELAY)
+    parser.add_argument("--tool-delay", type=float, default=TOOL_DELAY)
+    args = parser.parse_args()
+    LLM_DELAY, TOOL_DELAY = args.llm_delay, args.tool_delay
+    asyncio.run(main(args.asks, args.users, args.sessions))
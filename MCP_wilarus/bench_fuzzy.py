@@ -0,0 +1,75 @@
+"""
+Бенчмарк нечёткого поиска номенклатуры (TrigramIndex) на синтетическом справочнике.
+Запуск:
+    python bench_fuzzy.py --sizes 100000 1000000
+"""
+import argparse
+import random
+import time
+
+from trigram_index import TrigramIndex, normalize
+
+KINDS = ["Болт", "Гайка", "Шайба", "Винт", "Саморез", "Шуруп", "Анкер", "Дюбель", "Заклёпка", "Шпилька",
+         "Кабель", "Провод", "Труба", "Уголок", "Швеллер", "Лист", "Краска", "Грунтовка", "Клей", "Герметик"]
+MATERIALS = ["оцинкованный", "нержавеющий", "латунный", "стальной", "алюминиевый", "медный", "полимерный"]
+SIZES = ["М4", "М5", "М6", "М8", "М10", "М12", "М16", "3x20", "4x40", "5x60", "6x80", "1.5 мм", "2.5 мм", "10 л"]
+STANDARDS = ["ГОСТ 7798-70", "DIN 933", "DIN 934", "DIN 125", "ISO 4017", "ТУ 16.К71", ""]
+COLORS = ["белый", "чёрный", "жёлтый", "синий", "серый", "красный", ""]
+PACKS = ["упак. 50 шт", "упак. 100 шт", "упак. 200 шт", "упак. 500 шт", "10 м", "25 м", "50 м", "100 м", ""]
+
+
+def make_name(rnd: random.Random) -> str:
+    """Наименование из общего словаря, без уникального артикула: на 10^6 записей встречаются
+    повторы и много почти одинаковых наименований, как в живом справочнике."""
+    parts = [rnd.choice(KINDS), rnd.choice(MATERIALS), rnd.choice(SIZES), f"L={rnd.randrange(10, 310, 5)}",
+             rnd.choice(STANDARDS), rnd.choice(COLORS), rnd.choice(PACKS)]
+    return " ".join(p for p in parts if p)
+
+
+def distort(rnd: random.Random, name: str) -> str:
+    """Имитация расхождений в счёте: регистр, пропущенные слова, опечатка."""
+    words = name.split()
+    if len(words) > 3:
+        words.pop(rnd.randrange(1, len(words) - 1))
+    text = " ".join(words).upper() if rnd.random() < 0.5 else " ".join(words)
+    pos = rnd.randrange(len(text))
+    return text[:pos] + text[pos + 1:]
+
+
+def main(sizes, queries: int, k: int):
+    for size in sizes:
+        rnd = random.Random(size)
+        index = TrigramIndex()
+        names = []
+        started = time.perf_counter()
+        for i in range(size):
+            name = make_name(rnd)
+            names.append(name)
+            index.add(str(i), name)
+        build = time.perf_counter() - started
+        normalized = [normalize(name) for name in names]
+
+        targets = [rnd.randrange(size) for _ in range(queries)]
+        texts = [distort(rnd, names[t]) for t in targets]
+        latencies = []
+        hits = 0
+        for target, text in zip(targets, texts):
+            started = time.perf_counter()
+            result = index.search(text, k)
+            latencies.append(time.perf_counter() - started)
+            # попадание — найдено искомое наименование (у дубликатов оно одно на несколько записей)
+            hits += any(normalized[int(key)] == normalized[target] for key, _ in result)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2] * 1e3
+        p99 = latencies[int(len(latencies) * 0.99)] * 1e3
+        print(f"records={size:>8}  build={build:6.1f}s  recall@{k}={hits / queries:.2%}  "
+              f"p50={p50:.3f} мс  p99={p99:.3f} мс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    main(args.sizes, args.queries, args.k)
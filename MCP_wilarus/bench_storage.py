@@ -0,0 +1,67 @@
+"""
+Бенчмарк поиска в заглушке 1C: полный перебор (прежняя реализация) против хеш-индексов MemoryStorage.
+Запуск:
+    python bench_storage.py --sizes 100 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from typing import Dict, Optional
+
+from storage import MemoryStorage
+
+
+def scan_nomenclature(db: Dict[str, Dict], name: str) -> Optional[Dict]:
+    """Прежний поиск: перебор всех записей с lower() на каждой."""
+    for nid, item in db.items():
+        if item["name"].lower() == name.lower():
+            return {"id": nid, **item}
+    return None
+
+
+def scan_contractor(db: Dict[str, Dict], inn: str) -> Optional[Dict]:
+    for cid, c in db.items():
+        if c["inn"] == inn:
+            return {"id": cid, **c}
+    return None
+
+
+def per_lookup_us(fn, keys) -> float:
+    started = time.perf_counter()
+    for key in keys:
+        fn(key)
+    return (time.perf_counter() - started) / len(keys) * 1e6
+
+
+def main(sizes, lookups: int, scan_limit: int):
+    print(f"{'records':>10} | {'index nom, мкс':>15} | {'index inn, мкс':>15} | {'scan nom, мкс':>14} | {'scan inn, мкс':>14}")
+    for size in sizes:
+        storage = MemoryStorage()
+        for i in range(size):
+            storage.create_nomenclature({"name": f"Товар {i}", "unit": "шт"})
+            storage.create_contractor({"name": f"ООО {i}", "inn": f"{7700000000 + i}", "account": "", "bank": ""})
+
+        rnd = random.Random(size)
+        # половина запросов попадает, половина промахивается
+        names = [f"ТОВАР {rnd.randrange(size * 2)}" for _ in range(lookups)]
+        inns = [f"{7700000000 + rnd.randrange(size * 2)}" for _ in range(lookups)]
+
+        idx_nom = per_lookup_us(storage.find_nomenclature, names)
+        idx_inn = per_lookup_us(storage.find_contractor, inns)
+        if size <= scan_limit:
+            scan_keys = max(1, min(lookups, 10_000_000 // size))
+            scan_nom = f"{per_lookup_us(lambda n: scan_nomenclature(storage.nomenclature, n), names[:scan_keys]):14.1f}"
+            scan_inn = f"{per_lookup_us(lambda i: scan_contractor(storage.contractors, i), inns[:scan_keys]):14.1f}"
+        else:
+            scan_nom = scan_inn = f"{'-':>14}"
+        print(f"{size:>10} | {idx_nom:15.2f} | {idx_inn:15.2f} | {scan_nom} | {scan_inn}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10_000, 100_000, 1_000_000])
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--scan-limit", type=int, default=100_000,
+                        help="не запускать перебор на хранилищах больше этого размера")
+    args = parser.parse_args()
+    main(args.sizes, args.lookups, args.scan_limit)
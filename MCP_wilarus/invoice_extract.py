@@ -0,0 +1,100 @@
+"""Извлечение реквизитов и строк из текста счёта на оплату (после parse_pdf)."""
+import re
+from typing import Dict, List, Optional
+
+UNITS = r"шт|кг|г|т|м|м2|м3|км|л|упак|уп|компл|к-т|пар|рул|лист|час|усл|ед"
+
+NUMBER_RE = re.compile(r"Сч[её]т(?:[- ]оферта| на оплату)?\s*№\s*(?P<number>[\w/-]+)\s*от\s*(?P<date>[^\n]+?)\s*(?:г\.|\n|$)", re.I)
+INN_RE = re.compile(r"ИНН\s*:?\s*(?P<inn>\d{12}|\d{10})")
+KPP_RE = re.compile(r"КПП\s*:?\s*(?P<kpp>\d{9})")
+BIK_RE = re.compile(r"БИК\s*:?\s*(?P<bik>\d{9})")
+ACCOUNT_RE = re.compile(r"\b(?P<account>40[1-8]\d{17})\b")
+SUPPLIER_RE = re.compile(r"(?:Поставщик|Исполнитель|Продавец)[^:\n]*:\s*(?P<name>[^,\n]+)", re.I)
+TOTAL_RE = re.compile(r"Итого\s*(?:к оплате)?\s*:?\s*(?P<total>\d[\d \u00a0]*[.,]\d{2})", re.I)
+ITEM_RE = re.compile(
+    rf"^\s*(?P<n>\d+)[.)]?\s+(?P<name>.+?)\s+(?P<quantity>\d{{1,3}}(?:[ \u00a0]\d{{3}})+(?:[.,]\d+)?|\d+(?:[.,]\d+)?)\s+(?P<unit>{UNITS})\.?\s+"
+    rf"(?P<price>\d[\d \u00a0]*[.,]\d{{2}})\s+(?P<amount>\d[\d \u00a0]*[.,]\d{{2}})\s*$",
+    re.I | re.M,
+)
+
+
+def _number(value: str) -> float:
+    return float(re.sub(r"\s", "", value).replace(",", "."))
+
+
+def _section(text: str, start: str, end: str) -> str:
+    """Фрагмент текста от слова start до слова end (или до конца)."""
+    m = re.search(rf"(?:{start})(.*?)(?:{end}|$)", text, re.I | re.S)
+    return m.group(1) if m else ""
+
+
+def _bank(text: str) -> Optional[str]:
+    """Банк получателя — ближайшая непустая строка перед подписью «Банк получателя»."""
+    head = re.split(r"Банк получателя", text, maxsplit=1, flags=re.I)
+    if len(head) < 2:
+        return None
+    for line in reversed(head[0].splitlines()):
+        line = BIK_RE.sub("", line)
+        line = re.sub(r"Сч\.?\s*№?\s*\d{20}", "", line).strip(" |\t")
+        if line:
+            return line
+    return None
+
+
+def extract_items(text: str) -> List[Dict]:
+    return [
+        {
+            "name": m["name"].strip(" |"),
+            "quantity": _number(m["quantity"]),
+            "unit": m["unit"].lower(),
+            "price": _number(m["price"]),
+            "amount": _number(m["amount"]),
+        }
+        for m in ITEM_RE.finditer(text)
+    ]
+
+
+def check_invoice(invoice: Dict) -> List[str]:
+    """Арифметика счёта: количество × цена = сумма в каждой строке, сумма строк = итог.
+    Возвращает описания расхождений — непустой список значит, что строки распознаны неверно."""
+    problems = []
+    for i, item in enumerate(invoice["items"], 1):
+        # цена округлена до копеек: произведение может разойтись с суммой на полкопейки за единицу
+        if abs(item["quantity"] * item["price"] - item["amount"]) > max(0.01, item["quantity"] * 0.005):
+            problems.append(
+                f"строка {i}: {item['quantity']:g} × {item['price']:.2f} ≠ {item['amount']:.2f}"
+            )
+    if invoice["total"] is None:
+        problems.append("не найден итог счёта")
+    elif abs(sum(item["amount"] for item in invoice["items"]) - invoice["total"]) > 0.01:
+        problems.append(f"сумма строк не равна итогу {invoice['total']:.2f}")
+    return problems
+
+
+def extract_invoice(text: str) -> Dict:
+    """Черновик счёта: номер, дата, реквизиты поставщика, строки и итог.
+    Не найденные поля остаются None — их должен проверить человек или LLM."""
+    header = NUMBER_RE.search(text)
+    # реквизиты поставщика ищутся до блока покупателя, чтобы не взять ИНН покупателя
+    supplier_part = _section(text, "", r"Покупатель|Заказчик") or text
+    supplier_name = SUPPLIER_RE.search(text)
+    inn = INN_RE.search(_section(text, r"Поставщик|Исполнитель|Продавец", r"Покупатель|Заказчик")) \
+        or INN_RE.search(supplier_part)
+    kpp = KPP_RE.search(supplier_part)
+    bik = BIK_RE.search(supplier_part)
+    account = ACCOUNT_RE.search(supplier_part)
+    total = TOTAL_RE.search(text)
+    return {
+        "number": header["number"] if header else None,
+        "date": header["date"].strip() if header else None,
+        "supplier": {
+            "name": supplier_name["name"].strip() if supplier_name else None,
+            "inn": inn["inn"] if inn else None,
+            "kpp": kpp["kpp"] if kpp else None,
+            "account": account["account"] if account else None,
+            "bank": _bank(supplier_part),
+            "bik": bik["bik"] if bik else None,
+        },
+        "items": extract_items(text),
+        "total": _number(total["total"]) if total else None,
+    }
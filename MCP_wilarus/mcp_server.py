@@ -1,11 +1,23 @@
+import asyncio
+import os
+import uuid
+from collections import Counter
+
 import httpx
 from fastapi import Request
 from fastapi.responses import JSONResponse
-from typing import Annotated, List, Dict, Optional
+from typing import Annotated, List, Dict, Literal, Optional, Tuple
 from pydantic import Field
 from mcp.server.fastmcp import FastMCP
+from starlette.applications import Starlette
+
+from invoice_extract import check_invoice, extract_invoice
+from metrics import TraceMiddleware, instrument_fastmcp, metrics_endpoint
+from storage import IdempotencyConflict, create_storage
 
-API_BASE_URL = "http://localhost:9000/1c"
+# Заглушка 1C: по умолчанию её маршруты отдаёт этот же процесс; start_MCP.sh поднимает её
+# отдельно (api_app) и указывает сюда через API_1C_BASE_URL
+API_BASE_URL = os.getenv("API_1C_BASE_URL", "http://localhost:9000/1c")
 
 mcp = FastMCP("mcp_wilarus")
 
@@ -21,6 +33,18 @@ async def get_nomenclature(name: Annotated[str, Field(description="Наимен
         resp.raise_for_status()
         return resp.json()
 
+@mcp.tool()
+async def search_nomenclature(
+    name: Annotated[str, Field(description="Наименование товара, как в счёте")],
+    top_k: Annotated[int, Field(description="Сколько кандидатов вернуть", ge=1, le=20)] = 5,
+) -> List[Dict]:
+    """Нечёткий поиск номенклатуры по наименованию: top_k похожих карточек с оценкой score от 0 до 1.
+    Используй, когда get_nomenclature не нашёл точного совпадения, прежде чем создавать новую позицию."""
+    async with httpx.AsyncClient() as client:
+        resp = await client.get(f"{API_BASE_URL}/nomenclature/search", params={"q": name, "k": top_k})
+        resp.raise_for_status()
+        return resp.json()
+
 @mcp.tool()
 async def create_nomenclature(name: Annotated[str, Field(description="Наименование")], unit: Annotated[str, Field(description="Единица измерения")]) -> Dict:
     """Создать новую номенклатуру в 1С."""
@@ -50,21 +74,87 @@ async def create_contractor(name: str, inn: str, account: str, bank: str) -> Dic
         return resp.json()
 
 @mcp.tool()
-async def create_payment(data: Dict) -> Dict:
-    """Создать платёжное поручение."""
+async def get_nomenclature_bulk(
+    names: Annotated[List[str], Field(description="Наименования товаров")],
+) -> List[Dict]:
+    """Проверить наличие сразу нескольких позиций номенклатуры в 1С одним запросом.
+    Для каждого имени возвращается {"name", "item"}, где item — карточка или null, если её нет."""
     async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{API_BASE_URL}/payments", json=data)
+        resp = await client.post(f"{API_BASE_URL}/nomenclature/lookup", json={"names": names})
         resp.raise_for_status()
         return resp.json()
 
 @mcp.tool()
-async def create_receipt(data: Dict) -> Dict:
-    """Создать документ поступления товаров."""
+async def create_nomenclature_bulk(
+    items: Annotated[List[Dict], Field(description="Позиции [{\"name\": Наименование, \"unit\": Единица измерения}]")],
+) -> List[Dict]:
+    """Создать сразу несколько позиций номенклатуры в 1С одним запросом (в одной транзакции).
+    Для каждой позиции возвращается {"index", "item"} либо {"index", "error"}."""
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(f"{API_BASE_URL}/nomenclature/batch", json={"items": items})
+        resp.raise_for_status()
+        return resp.json()
+
+@mcp.tool()
+async def get_contractor_bulk(
+    inns: Annotated[List[str], Field(description="ИНН контрагентов")],
+) -> List[Dict]:
+    """Найти сразу несколько контрагентов по ИНН одним запросом.
+    Для каждого ИНН возвращается {"inn", "item"}, где item — карточка или null, если её нет."""
+    async with httpx.AsyncClient() as client:
+        resp = await client.post(f"{API_BASE_URL}/contractors/lookup", json={"inns": inns})
+        resp.raise_for_status()
+        return resp.json()
+
+@mcp.tool()
+async def create_contractor_bulk(
+    items: Annotated[List[Dict], Field(description="Контрагенты [{\"name\", \"inn\", \"account\", \"bank\"}]")],
+) -> List[Dict]:
+    """Создать сразу несколько карточек контрагентов одним запросом (в одной транзакции).
+    Для каждого контрагента возвращается {"index", "item"} либо {"index", "error"}."""
     async with httpx.AsyncClient() as client:
-        resp = await client.post(f"{API_BASE_URL}/receipts", json=data)
+        resp = await client.post(f"{API_BASE_URL}/contractors/batch", json={"items": items})
         resp.raise_for_status()
         return resp.json()
 
+# Создание документов идёт с коротким таймаутом и повторами: повтор с тем же
+# ключом идемпотентности возвращает уже созданный документ, а не дубль
+DOCUMENT_TIMEOUT = float(os.getenv("DOCUMENT_TIMEOUT", "5"))
+DOCUMENT_RETRIES = int(os.getenv("DOCUMENT_RETRIES", "3"))
+
+IdempotencyKey = Annotated[
+    Optional[str],
+    Field(description="Ключ идемпотентности: при повторе того же документа передай тот же ключ, "
+                      "например номер счёта поставщика"),
+]
+
+async def _post_document(path: str, data: Dict, idempotency_key: Optional[str]) -> Dict:
+    # без ключа от агента ключ всё равно нужен, чтобы повторы внутри вызова не создали дубль
+    headers = {"Idempotency-Key": idempotency_key or uuid.uuid4().hex}
+    async with httpx.AsyncClient(timeout=DOCUMENT_TIMEOUT) as client:
+        for attempt in range(DOCUMENT_RETRIES + 1):
+            last = attempt == DOCUMENT_RETRIES
+            try:
+                resp = await client.post(f"{API_BASE_URL}{path}", json=data, headers=headers)
+            except httpx.TransportError:
+                if last:
+                    raise
+            else:
+                if resp.status_code < 500 or last:
+                    resp.raise_for_status()
+                    return resp.json()
+            await asyncio.sleep(0.2 * 2 ** attempt)
+
+@mcp.tool()
+async def create_payment(data: Dict, idempotency_key: IdempotencyKey = None) -> Dict:
+    """Создать платёжное поручение."""
+    return await _post_document("/payments", data, idempotency_key)
+
+@mcp.tool()
+async def create_receipt(data: Dict, idempotency_key: IdempotencyKey = None) -> Dict:
+    """Создать документ поступления товаров."""
+    return await _post_document("/receipts", data, idempotency_key)
+
 @mcp.tool()
 async def get_receipt_status(receipt_id: str) -> Dict:
     """Получить статус документа поступления."""
@@ -73,63 +163,340 @@ async def get_receipt_status(receipt_id: str) -> Dict:
         resp.raise_for_status()
         return resp.json()
 
+# Дольше этого сервер заглушки не держит запрос ожидания статуса
+RECEIPT_WAIT_MAX = float(os.getenv("RECEIPT_WAIT_MAX", "60"))
+
+@mcp.tool()
+async def wait_receipt_status(
+    receipt_id: str,
+    current_status: Annotated[str, Field(description="Известный статус, смены которого ждём")] = "created",
+    timeout: Annotated[float, Field(description="Сколько секунд ждать", gt=0, le=RECEIPT_WAIT_MAX)] = 30,
+) -> Dict:
+    """Дождаться смены статуса документа поступления (например, проведения) без повторных опросов.
+    Возвращает {"receipt_id", "status", "changed"}; changed=false — статус не сменился за timeout."""
+    params = {"status": current_status, "timeout": timeout}
+    async with httpx.AsyncClient(timeout=timeout + 10) as client:
+        resp = await client.get(f"{API_BASE_URL}/receipts/{receipt_id}/wait", params=params)
+        resp.raise_for_status()
+        return resp.json()
+
+@mcp.tool()
+async def wait_receipts_status(
+    receipt_ids: List[str],
+    current_status: Annotated[str, Field(description="Известный статус, смены которого ждём")] = "created",
+    timeout: Annotated[float, Field(description="Сколько секунд ждать", gt=0, le=RECEIPT_WAIT_MAX)] = 30,
+    mode: Annotated[Literal["all", "any"], Field(description="all — ждать смены у всех, any — хотя бы у одного")] = "all",
+) -> List[Dict]:
+    """Дождаться смены статуса сразу у нескольких документов поступления одним вызовом.
+    Для каждого документа возвращается {"receipt_id", "status", "changed"}; если какого-то
+    документа нет, вызов завершается ошибкой 404 со списком неизвестных receipt_ids."""
+    payload = {"receipt_ids": receipt_ids, "status": current_status, "timeout": timeout, "mode": mode}
+    async with httpx.AsyncClient(timeout=timeout + 10) as client:
+        resp = await client.post(f"{API_BASE_URL}/receipts/wait", json=payload)
+        resp.raise_for_status()
+        return resp.json()
+
+# --- Composite pipeline ---
+
+@mcp.tool()
+async def invoice_to_receipt(
+    pdf_path: Annotated[str, Field(description="Путь к PDF счёта поставщика")],
+    dry_run: Annotated[bool, Field(description="Только черновик: ничего не создавать в 1С")] = False,
+) -> Dict:
+    """Провести счёт поставщика в поступление за один вызов: распознать PDF, найти или создать
+    контрагента и номенклатуру, создать документ поступления. Возвращает черновик с найденными
+    и созданными ID — проверь его и подтверди результат пользователю.
+    status: created — документ создан, draft — dry_run, needs_review — не удалось распознать ИНН
+    или строки либо не сходится арифметика счёта (problems); тогда в 1С ничего не создаётся."""
+    # pdfminer / pdf2image / pytesseract нужны только этому инструменту
+    from parse_pdf import parse_pdf
+
+    text = await asyncio.to_thread(parse_pdf, pdf_path)
+    invoice = extract_invoice(text)
+    supplier, items = invoice["supplier"], invoice["items"]
+    problems = check_invoice(invoice) if items else ["не найдены строки счёта"]
+    if not supplier["inn"]:
+        problems.insert(0, "не найден ИНН поставщика")
+    if problems:
+        return {"status": "needs_review", "problems": problems, "invoice": invoice, "text": text[:3000]}
+
+    # контрагент и вся номенклатура ищутся параллельно, номенклатура — одним пакетным запросом
+    contractor, lookups = await asyncio.gather(
+        get_contractor(supplier["inn"]),
+        get_nomenclature_bulk([item["name"] for item in items]),
+    )
+    missing = [i for i, found in enumerate(lookups) if found["item"] is None]
+    draft = {
+        "invoice": invoice,
+        "contractor": {"id": contractor["id"] if contractor else None, "created": False},
+        "items": [
+            {**item, "nomenclature_id": found["item"]["id"] if found["item"] else None, "created": False}
+            for item, found in zip(items, lookups)
+        ],
+    }
+    if dry_run:
+        return {"status": "draft", **draft}
+
+    async def no_contractor() -> None:
+        return None
+
+    async def no_items() -> List[Dict]:
+        return []
+
+    created_contractor, created_items = await asyncio.gather(
+        no_contractor() if contractor else create_contractor(
+            supplier["name"] or supplier["inn"], supplier["inn"], supplier["account"] or "", supplier["bank"] or ""
+        ),
+        create_nomenclature_bulk([{"name": items[i]["name"], "unit": items[i]["unit"]} for i in missing])
+        if missing else no_items(),
+    )
+    if created_contractor:
+        draft["contractor"] = {"id": created_contractor["id"], "created": True}
+    for i, result in zip(missing, created_items):
+        if "item" in result:
+            draft["items"][i].update(nomenclature_id=result["item"]["id"], created=True)
+        else:
+            draft["items"][i]["error"] = result.get("error")
+    if any(item["nomenclature_id"] is None for item in draft["items"]):
+        return {"status": "needs_review", **draft}
+
+    receipt = await create_receipt(
+        {
+            "contractor_id": draft["contractor"]["id"],
+            "number": invoice["number"],
+            "date": invoice["date"],
+            "items": [
+                {k: item[k] for k in ("nomenclature_id", "quantity", "unit", "price", "amount")}
+                for item in draft["items"]
+            ],
+            "total": invoice["total"],
+        },
+        # повторный вызов по тому же счёту вернёт уже созданное поступление
+        idempotency_key=f"invoice:{supplier['inn']}:{invoice['number']}" if invoice["number"] else None,
+    )
+    return {"status": "created", **draft, "receipt": receipt}
+
 # --- Dummy 1C API implementation ---
 
-nomenclature_db: Dict[str, Dict] = {}
-contractor_db: Dict[str, Dict] = {}
-payment_db: Dict[str, Dict] = {}
-receipt_db: Dict[str, Dict] = {}
+# Хранилище заглушки: memory (по умолчанию) или sqlite — данные в файле STORAGE_PATH переживают
+# перезапуск, и заглушку можно запускать в несколько воркеров uvicorn
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "dummy_1c.db")
+# Таблица ключей идемпотентности ограничена по времени жизни и по числу ключей
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+
+storage = create_storage(
+    STORAGE_BACKEND,
+    STORAGE_PATH,
+    idempotency_ttl=IDEMPOTENCY_TTL,
+    idempotency_max_keys=IDEMPOTENCY_MAX_KEYS,
+)
 
 @mcp.custom_route("/1c/nomenclature", methods=["GET"])
 async def api_get_nomenclature(request: Request):
-    name = request.query_params.get("name")
-    for nid, item in nomenclature_db.items():
-        if item["name"].lower() == name.lower():
-            return JSONResponse({"id": nid, **item})
-    return JSONResponse({"detail": "not found"}, status_code=404)
+    name = request.query_params.get("name", "")
+    item = storage.find_nomenclature(name)
+    if item is None:
+        return JSONResponse({"detail": "not found"}, status_code=404)
+    return JSONResponse(item)
+
+@mcp.custom_route("/1c/nomenclature/search", methods=["GET"])
+async def api_search_nomenclature(request: Request):
+    query = request.query_params.get("q", "")
+    k = min(int(request.query_params.get("k", 5)), 100)
+    return JSONResponse(storage.search_nomenclature(query, k))
 
 @mcp.custom_route("/1c/nomenclature", methods=["POST"])
 async def api_create_nomenclature(request: Request):
     data = await request.json()
-    nid = str(len(nomenclature_db) + 1)
-    nomenclature_db[nid] = data
-    return JSONResponse({"id": nid, **data})
+    return JSONResponse(storage.create_nomenclature(data))
 
 @mcp.custom_route("/1c/contractors", methods=["GET"])
 async def api_get_contractor(request: Request):
-    inn = request.query_params.get("inn")
-    for cid, c in contractor_db.items():
-        if c["inn"] == inn:
-            return JSONResponse({"id": cid, **c})
-    return JSONResponse({"detail": "not found"}, status_code=404)
+    inn = request.query_params.get("inn", "")
+    contractor = storage.find_contractor(inn)
+    if contractor is None:
+        return JSONResponse({"detail": "not found"}, status_code=404)
+    return JSONResponse(contractor)
 
 @mcp.custom_route("/1c/contractors", methods=["POST"])
 async def api_create_contractor(request: Request):
     data = await request.json()
-    cid = str(len(contractor_db) + 1)
-    contractor_db[cid] = data
-    return JSONResponse({"id": cid, **data})
+    return JSONResponse(storage.create_contractor(data))
+
+def _create_batch(items: List, required: tuple, create_many) -> List[Dict]:
+    """Проверить позиции пакета, корректные создать одной транзакцией; результат — по каждой позиции."""
+    results: List[Dict] = [{} for _ in items]
+    valid = []
+    for i, item in enumerate(items):
+        missing = [f for f in required if not isinstance(item, dict) or not item.get(f)]
+        if missing:
+            results[i] = {"index": i, "error": f"не заполнены поля: {', '.join(missing)}"}
+        else:
+            valid.append(i)
+    for i, created in zip(valid, create_many([items[i] for i in valid])):
+        results[i] = {"index": i, "item": created}
+    return results
+
+@mcp.custom_route("/1c/nomenclature/lookup", methods=["POST"])
+async def api_lookup_nomenclature(request: Request):
+    names = (await request.json()).get("names", [])
+    found = storage.find_nomenclature_many(names)
+    return JSONResponse([{"name": name, "item": item} for name, item in zip(names, found)])
+
+@mcp.custom_route("/1c/nomenclature/batch", methods=["POST"])
+async def api_create_nomenclature_batch(request: Request):
+    items = (await request.json()).get("items", [])
+    return JSONResponse(_create_batch(items, ("name", "unit"), storage.create_nomenclature_many))
+
+@mcp.custom_route("/1c/contractors/lookup", methods=["POST"])
+async def api_lookup_contractors(request: Request):
+    inns = (await request.json()).get("inns", [])
+    found = storage.find_contractor_many(inns)
+    return JSONResponse([{"inn": inn, "item": item} for inn, item in zip(inns, found)])
+
+@mcp.custom_route("/1c/contractors/batch", methods=["POST"])
+async def api_create_contractors_batch(request: Request):
+    items = (await request.json()).get("items", [])
+    return JSONResponse(_create_batch(items, ("name", "inn"), storage.create_contractor_many))
+
+def _create_idempotent(create, data: Dict, request: Request) -> JSONResponse:
+    try:
+        return JSONResponse(create(data, request.headers.get("idempotency-key")))
+    except IdempotencyConflict:
+        return JSONResponse(
+            {"detail": "Idempotency-Key уже использован для другого документа"}, status_code=422
+        )
 
 @mcp.custom_route("/1c/payments", methods=["POST"])
 async def api_create_payment(request: Request):
     data = await request.json()
-    pid = str(len(payment_db) + 1)
-    payment_db[pid] = {"status": "created", **data}
-    return JSONResponse({"payment_id": pid, "status": "created"})
+    return _create_idempotent(storage.create_payment, data, request)
 
 @mcp.custom_route("/1c/receipts", methods=["POST"])
 async def api_create_receipt(request: Request):
     data = await request.json()
-    rid = str(len(receipt_db) + 1)
-    receipt_db[rid] = {"status": "created", **data}
-    return JSONResponse({"receipt_id": rid, "status": "created"})
+    return _create_idempotent(storage.create_receipt, data, request)
 
 @mcp.custom_route("/1c/receipts/{rid}", methods=["GET"])
-async def api_get_receipt(request: Request, rid: str):
-    rec = receipt_db.get(rid)
+async def api_get_receipt(request: Request):
+    rid = request.path_params["rid"]
+    rec = storage.get_receipt(rid)
+    if not rec:
+        return JSONResponse({"detail": "not found"}, status_code=404)
+    return JSONResponse(rec)
+
+@mcp.custom_route("/1c/receipts/{rid}/status", methods=["POST"])
+async def api_set_receipt_status(request: Request):
+    """Сменить статус документа (имитация проведения в 1C) и разбудить ожидающих."""
+    rid = request.path_params["rid"]
+    status = (await request.json()).get("status", "posted")
+    rec = storage.set_receipt_status(rid, status)
     if not rec:
         return JSONResponse({"detail": "not found"}, status_code=404)
-    return JSONResponse({"receipt_id": rid, "status": rec["status"]})
+    receipt_watch.notify(rid)
+    return JSONResponse(rec)
+
+class StatusWatch:
+    """Ожидание смены статуса на asyncio.Event. Событие будит ожидающих в этом процессе;
+    смену статуса другим воркером (STORAGE_BACKEND=sqlite) ловит перепроверка раз в recheck секунд."""
+
+    def __init__(self, recheck: float = 1.0):
+        self.recheck = recheck
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Counter = Counter()
+
+    def notify(self, key: str) -> None:
+        event = self._events.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def wait(self, key: str, get_status, known_status: str, timeout: float) -> Tuple[Optional[Dict], bool]:
+        """Ждать, пока get_status() не вернёт статус, отличный от known_status. -> (запись, сменился ли)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            rec = get_status()
+            if rec is None or rec["status"] != known_status:
+                return rec, rec is not None
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return rec, False
+            event = self._events.setdefault(key, asyncio.Event())
+            self._waiters[key] += 1
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, self.recheck))
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self._waiters[key] -= 1
+                if not self._waiters[key]:
+                    del self._waiters[key]
+                    if self._events.get(key) is event:
+                        del self._events[key]
+
+receipt_watch = StatusWatch()
+
+async def _wait_receipt(rid: str, known_status: str, timeout: float) -> Dict:
+    rec, changed = await receipt_watch.wait(rid, lambda: storage.get_receipt(rid), known_status, timeout)
+    if rec is None:
+        return {"receipt_id": rid, "status": None, "changed": False, "detail": "not found"}
+    return {**rec, "changed": changed}
+
+@mcp.custom_route("/1c/receipts/{rid}/wait", methods=["GET"])
+async def api_wait_receipt(request: Request):
+    """Long-poll: ответ приходит при смене статуса относительно status или по истечении timeout."""
+    rid = request.path_params["rid"]
+    known_status = request.query_params.get("status", "created")
+    timeout = min(float(request.query_params.get("timeout", 30)), RECEIPT_WAIT_MAX)
+    result = await _wait_receipt(rid, known_status, timeout)
+    if result["status"] is None:
+        return JSONResponse({"detail": "not found"}, status_code=404)
+    return JSONResponse(result)
+
+@mcp.custom_route("/1c/receipts/wait", methods=["POST"])
+async def api_wait_receipts(request: Request):
+    """Long-poll по нескольким документам: mode=all — до смены у всех, mode=any — у первого.
+    Неизвестные receipt_ids — 404, как у одиночного ожидания: иначе их мгновенный ответ
+    «не найден» завершал бы mode=any сразу."""
+    body = await request.json()
+    rids = list(dict.fromkeys(body.get("receipt_ids", [])))
+    known_status = body.get("status", "created")
+    timeout = min(float(body.get("timeout", 30)), RECEIPT_WAIT_MAX)
+    unknown = [rid for rid in rids if storage.get_receipt(rid) is None]
+    if unknown:
+        return JSONResponse({"detail": "not found", "receipt_ids": unknown}, status_code=404)
+    tasks = [asyncio.ensure_future(_wait_receipt(rid, known_status, timeout)) for rid in rids]
+    if tasks and body.get("mode") == "any":
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        results = [
+            task.result() if task in done else {**(storage.get_receipt(rid) or {"receipt_id": rid}), "changed": False}
+            for rid, task in zip(rids, tasks)
+        ]
+    else:
+        results = await asyncio.gather(*tasks)
+    return JSONResponse(results)
+
+# Метрики Prometheus (tool_call_seconds, http_request_seconds) и trace id от llm_server
+mcp.custom_route("/metrics", methods=["GET"])(metrics_endpoint)
+instrument_fastmcp(mcp, "mcp_server")
+
+# MCP по SSE: сессии живут в памяти процесса, и POST /messages/?session_id= должен попасть
+# в тот же процесс, что держит SSE-поток, — только один воркер: uvicorn mcp_server:app --workers 1
+app = mcp.sse_app()
+app.add_middleware(TraceMiddleware, service="mcp_server")
+
+# Только заглушка 1C (/1c/*, /metrics), без MCP: её можно запускать в несколько воркеров
+# вместе с STORAGE_BACKEND=sqlite: uvicorn mcp_server:api_app --workers N
+api_app = Starlette(routes=mcp._custom_starlette_routes)
+api_app.add_middleware(TraceMiddleware, service="dummy_1c")
 
 if __name__ == "__main__":
-    mcp.run(transport="sse")
+    import uvicorn
+
+    # mcp.run(transport="sse") собрал бы новое приложение без TraceMiddleware
+    uvicorn.run(app, host=mcp.settings.host, port=mcp.settings.port)
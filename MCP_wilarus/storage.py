@@ -0,0 +1,368 @@
+"""Хранилища для заглушки 1C API из mcp_server.py."""
+import hashlib
+import itertools
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from trigram_index import TrigramIndex
+
+# Ключи идемпотентности хранятся сутки, не больше IDEMPOTENCY_MAX_KEYS штук
+IDEMPOTENCY_TTL = 24 * 3600.0
+IDEMPOTENCY_MAX_KEYS = 100_000
+
+
+class IdempotencyConflict(Exception):
+    """Ключ идемпотентности уже использован для документа с другим содержимым."""
+
+
+def fingerprint(data: Dict) -> str:
+    return hashlib.sha256(json.dumps(data, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+class IdempotencyCache:
+    """Ответы на запросы с ключом идемпотентности: ограничены по размеру и по TTL.
+    Записи упорядочены по времени вставки, поэтому устаревшие всегда в начале."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_size: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[float, str, Dict]]" = OrderedDict()
+
+    def _purge(self) -> None:
+        now = time.time()
+        while self._items and next(iter(self._items.values()))[0] <= now:
+            self._items.popitem(last=False)
+
+    def get(self, key: str, data_fingerprint: str) -> Optional[Dict]:
+        self._purge()
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry[1] != data_fingerprint:
+            raise IdempotencyConflict(key)
+        return entry[2]
+
+    def put(self, key: str, data_fingerprint: str, response: Dict) -> None:
+        self._items[key] = (time.time() + self.ttl, data_fingerprint, response)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+
+class MemoryStorage:
+    """Данные в памяти процесса. Индексы по имени номенклатуры (casefold) и по ИНН контрагента
+    поддерживаются при вставке, поэтому поиск не зависит от числа записей."""
+
+    def __init__(self, idempotency_ttl: float = IDEMPOTENCY_TTL, idempotency_max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.nomenclature: Dict[str, Dict] = {}
+        self.contractors: Dict[str, Dict] = {}
+        self.payments: Dict[str, Dict] = {}
+        self.receipts: Dict[str, Dict] = {}
+        self._nomenclature_by_name: Dict[str, str] = {}
+        self._nomenclature_trigrams = TrigramIndex()
+        self._contractor_by_inn: Dict[str, str] = {}
+        # next() у itertools.count атомарен, поэтому параллельные создания не получат один ID
+        self._ids = {
+            "nomenclature": itertools.count(1),
+            "contractors": itertools.count(1),
+            "payments": itertools.count(1),
+            "receipts": itertools.count(1),
+        }
+        self._idempotency = IdempotencyCache(idempotency_ttl, idempotency_max_keys)
+
+    def _next_id(self, table: str) -> str:
+        return str(next(self._ids[table]))
+
+    def find_nomenclature(self, name: str) -> Optional[Dict]:
+        nid = self._nomenclature_by_name.get(name.casefold())
+        if nid is None:
+            return None
+        return {"id": nid, **self.nomenclature[nid]}
+
+    def create_nomenclature(self, data: Dict) -> Dict:
+        nid = self._next_id("nomenclature")
+        self.nomenclature[nid] = data
+        # при совпадении имён находится первая созданная запись, как и при полном переборе
+        self._nomenclature_by_name.setdefault(str(data.get("name", "")).casefold(), nid)
+        self._nomenclature_trigrams.add(nid, str(data.get("name", "")))
+        return {"id": nid, **data}
+
+    def search_nomenclature(self, query: str, k: int = 5) -> List[Dict]:
+        return [
+            {"id": nid, **self.nomenclature[nid], "score": score}
+            for nid, score in self._nomenclature_trigrams.search(query, k)
+        ]
+
+    def find_nomenclature_many(self, names: List[str]) -> List[Optional[Dict]]:
+        return [self.find_nomenclature(name) for name in names]
+
+    def create_nomenclature_many(self, items: List[Dict]) -> List[Dict]:
+        # выполняется без await, поэтому для других запросов пакет виден целиком
+        return [self.create_nomenclature(item) for item in items]
+
+    def find_contractor(self, inn: str) -> Optional[Dict]:
+        cid = self._contractor_by_inn.get(inn)
+        if cid is None:
+            return None
+        return {"id": cid, **self.contractors[cid]}
+
+    def create_contractor(self, data: Dict) -> Dict:
+        cid = self._next_id("contractors")
+        self.contractors[cid] = data
+        self._contractor_by_inn.setdefault(str(data.get("inn", "")), cid)
+        return {"id": cid, **data}
+
+    def find_contractor_many(self, inns: List[str]) -> List[Optional[Dict]]:
+        return [self.find_contractor(inn) for inn in inns]
+
+    def create_contractor_many(self, items: List[Dict]) -> List[Dict]:
+        return [self.create_contractor(item) for item in items]
+
+    def _create_document(self, table: str, id_field: str, data: Dict, idempotency_key: Optional[str]) -> Dict:
+        """Создать документ; повтор с тем же ключом идемпотентности возвращает исходный документ."""
+        if idempotency_key is not None:
+            key, data_fp = f"{table}:{idempotency_key}", fingerprint(data)
+            replay = self._idempotency.get(key, data_fp)
+            if replay is not None:
+                return replay
+        doc_id = self._next_id(table)
+        getattr(self, table)[doc_id] = {"status": "created", **data}
+        response = {id_field: doc_id, "status": "created"}
+        if idempotency_key is not None:
+            self._idempotency.put(key, data_fp, response)
+        return response
+
+    def create_payment(self, data: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        return self._create_document("payments", "payment_id", data, idempotency_key)
+
+    def create_receipt(self, data: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        return self._create_document("receipts", "receipt_id", data, idempotency_key)
+
+    def get_receipt(self, rid: str) -> Optional[Dict]:
+        rec = self.receipts.get(rid)
+        if not rec:
+            return None
+        return {"receipt_id": rid, "status": rec["status"]}
+
+    def set_receipt_status(self, rid: str, status: str) -> Optional[Dict]:
+        rec = self.receipts.get(rid)
+        if not rec:
+            return None
+        rec["status"] = status
+        return {"receipt_id": rid, "status": status}
+
+
+class SQLiteStorage:
+    """Данные в файле SQLite в режиме WAL: переживают перезапуск, и несколько воркеров uvicorn
+    могут работать с одним файлом. ID выдаёт сама SQLite (AUTOINCREMENT), поэтому они уникальны
+    и между процессами. Запросы параметризованы и переиспользуются из кеша подготовленных
+    выражений sqlite3."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS nomenclature (
+            id          INTEGER PRIMARY KEY AUTOINCREMENT,
+            name_folded TEXT NOT NULL,
+            data        TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS nomenclature_name_folded ON nomenclature (name_folded);
+        CREATE TABLE IF NOT EXISTS contractors (
+            id   INTEGER PRIMARY KEY AUTOINCREMENT,
+            inn  TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS contractors_inn ON contractors (inn);
+        CREATE TABLE IF NOT EXISTS payments (
+            id     INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL,
+            data   TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS receipts (
+            id     INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL,
+            data   TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS idempotency (
+            key         TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            response    TEXT NOT NULL,
+            created_at  REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idempotency_created_at ON idempotency (created_at);
+    """
+
+    def __init__(self, path: str, busy_timeout: float = 5.0,
+                 idempotency_ttl: float = IDEMPOTENCY_TTL, idempotency_max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.path = path
+        self.idempotency_ttl = idempotency_ttl
+        self.idempotency_max_keys = idempotency_max_keys
+        self._conn = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, cached_statements=256)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(self.SCHEMA)
+        # Триграммный индекс живёт в памяти процесса и догружает записи с id больше последней
+        # известной, включая созданные другими воркерами
+        self._nomenclature_trigrams = TrigramIndex()
+        self._trigrams_last_id = 0
+
+    def _insert(self, sql: str, params: tuple) -> str:
+        with self._conn:
+            return str(self._conn.execute(sql, params).lastrowid)
+
+    def _insert_many(self, sql: str, params: List[tuple]) -> List[str]:
+        """Вставить пакет в одной транзакции: либо все записи, либо ни одной."""
+        with self._conn:
+            return [str(self._conn.execute(sql, p).lastrowid) for p in params]
+
+    def _find_many(self, sql: str, keys: List[str]) -> Dict[str, Dict]:
+        """Один запрос WHERE key IN (...) на весь пакет; для каждого ключа — запись с меньшим id."""
+        found: Dict[str, Dict] = {}
+        unique = list(dict.fromkeys(keys))
+        # SQLite ограничивает число параметров в запросе
+        for i in range(0, len(unique), 500):
+            chunk = unique[i:i + 500]
+            rows = self._conn.execute(sql.format(",".join("?" * len(chunk))), chunk).fetchall()
+            for key, rid, data in rows:
+                found.setdefault(key, {"id": str(rid), **json.loads(data)})
+        return found
+
+    def find_nomenclature(self, name: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            "SELECT id, data FROM nomenclature WHERE name_folded = ? ORDER BY id LIMIT 1",
+            (name.casefold(),),
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": str(row[0]), **json.loads(row[1])}
+
+    def create_nomenclature(self, data: Dict) -> Dict:
+        nid = self._insert(
+            "INSERT INTO nomenclature (name_folded, data) VALUES (?, ?)",
+            (str(data.get("name", "")).casefold(), json.dumps(data, ensure_ascii=False)),
+        )
+        return {"id": nid, **data}
+
+    def _sync_trigrams(self) -> None:
+        rows = self._conn.execute(
+            "SELECT id, json_extract(data, '$.name') FROM nomenclature WHERE id > ? ORDER BY id",
+            (self._trigrams_last_id,),
+        ).fetchall()
+        for nid, name in rows:
+            self._nomenclature_trigrams.add(str(nid), name or "")
+        if rows:
+            self._trigrams_last_id = rows[-1][0]
+
+    def search_nomenclature(self, query: str, k: int = 5) -> List[Dict]:
+        self._sync_trigrams()
+        hits = self._nomenclature_trigrams.search(query, k)
+        if not hits:
+            return []
+        ids = [nid for nid, _ in hits]
+        rows = dict(self._conn.execute(
+            f"SELECT id, data FROM nomenclature WHERE id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall())
+        return [{"id": nid, **json.loads(rows[int(nid)]), "score": score} for nid, score in hits]
+
+    def find_nomenclature_many(self, names: List[str]) -> List[Optional[Dict]]:
+        folded = [name.casefold() for name in names]
+        found = self._find_many(
+            "SELECT name_folded, id, data FROM nomenclature WHERE name_folded IN ({}) ORDER BY id", folded
+        )
+        return [found.get(name) for name in folded]
+
+    def create_nomenclature_many(self, items: List[Dict]) -> List[Dict]:
+        ids = self._insert_many(
+            "INSERT INTO nomenclature (name_folded, data) VALUES (?, ?)",
+            [(str(item.get("name", "")).casefold(), json.dumps(item, ensure_ascii=False)) for item in items],
+        )
+        return [{"id": nid, **item} for nid, item in zip(ids, items)]
+
+    def find_contractor(self, inn: str) -> Optional[Dict]:
+        row = self._conn.execute(
+            "SELECT id, data FROM contractors WHERE inn = ? ORDER BY id LIMIT 1", (inn,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": str(row[0]), **json.loads(row[1])}
+
+    def create_contractor(self, data: Dict) -> Dict:
+        cid = self._insert(
+            "INSERT INTO contractors (inn, data) VALUES (?, ?)",
+            (str(data.get("inn", "")), json.dumps(data, ensure_ascii=False)),
+        )
+        return {"id": cid, **data}
+
+    def find_contractor_many(self, inns: List[str]) -> List[Optional[Dict]]:
+        found = self._find_many("SELECT inn, id, data FROM contractors WHERE inn IN ({}) ORDER BY id", inns)
+        return [found.get(inn) for inn in inns]
+
+    def create_contractor_many(self, items: List[Dict]) -> List[Dict]:
+        ids = self._insert_many(
+            "INSERT INTO contractors (inn, data) VALUES (?, ?)",
+            [(str(item.get("inn", "")), json.dumps(item, ensure_ascii=False)) for item in items],
+        )
+        return [{"id": cid, **item} for cid, item in zip(ids, items)]
+
+    def _create_document(self, table: str, id_field: str, data: Dict, idempotency_key: Optional[str]) -> Dict:
+        """Создать документ; повтор с тем же ключом идемпотентности возвращает исходный документ.
+        Проверка ключа и вставка идут в одной транзакции BEGIN IMMEDIATE, поэтому одновременные
+        повторы из разных воркеров не создадут дубль."""
+        insert = f"INSERT INTO {table} (status, data) VALUES (?, ?)"
+        params = ("created", json.dumps(data, ensure_ascii=False))
+        if idempotency_key is None:
+            return {id_field: self._insert(insert, params), "status": "created"}
+
+        key, data_fp, now = f"{table}:{idempotency_key}", fingerprint(data), time.time()
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("DELETE FROM idempotency WHERE created_at < ?", (now - self.idempotency_ttl,))
+            row = self._conn.execute(
+                "SELECT fingerprint, response FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                if row[0] != data_fp:
+                    raise IdempotencyConflict(idempotency_key)
+                return json.loads(row[1])
+            response = {id_field: str(self._conn.execute(insert, params).lastrowid), "status": "created"}
+            self._conn.execute(
+                "INSERT INTO idempotency (key, fingerprint, response, created_at) VALUES (?, ?, ?, ?)",
+                (key, data_fp, json.dumps(response), now),
+            )
+            self._conn.execute(
+                "DELETE FROM idempotency WHERE key IN "
+                "(SELECT key FROM idempotency ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.idempotency_max_keys,),
+            )
+        return response
+
+    def create_payment(self, data: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        return self._create_document("payments", "payment_id", data, idempotency_key)
+
+    def create_receipt(self, data: Dict, idempotency_key: Optional[str] = None) -> Dict:
+        return self._create_document("receipts", "receipt_id", data, idempotency_key)
+
+    def get_receipt(self, rid: str) -> Optional[Dict]:
+        row = self._conn.execute("SELECT status FROM receipts WHERE id = ?", (rid,)).fetchone()
+        if row is None:
+            return None
+        return {"receipt_id": rid, "status": row[0]}
+
+    def set_receipt_status(self, rid: str, status: str) -> Optional[Dict]:
+        with self._conn:
+            updated = self._conn.execute("UPDATE receipts SET status = ? WHERE id = ?", (status, rid)).rowcount
+        if not updated:
+            return None
+        return {"receipt_id": rid, "status": status}
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def create_storage(backend: str, path: str, **options):
+    """Выбрать хранилище по настройке: memory или sqlite."""
+    if backend == "memory":
+        return MemoryStorage(**options)
+    if backend == "sqlite":
+        return SQLiteStorage(path, **options)
+    raise ValueError(f"Неизвестное хранилище: {backend!r} (ожидается memory или sqlite)")
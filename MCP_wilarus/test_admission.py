@@ -0,0 +1,64 @@
+"""
+Регрессии AdmissionController:
+  - отмена запроса в очереди в тот же шаг цикла, когда другой запрос освобождает место,
+    не должна терять место;
+  - LLM_QUEUE_LIMIT действует на каждый вызов модели, а не только на вход HTTP-запроса.
+Запуск:
+    python -m pytest -q test_admission.py
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from llm_server import AdmissionController
+
+
+def test_cancelled_waiter_does_not_leak_slot():
+    async def scenario():
+        admission = AdmissionController(1, 10, {"interactive": 1, "batch": 1})
+        await admission._acquire("interactive")  # держит единственное место
+        first = asyncio.create_task(admission._acquire("interactive"))
+        second = asyncio.create_task(admission._acquire("interactive"))
+        await asyncio.sleep(0)  # оба ждут в очереди
+
+        # отмена и освобождение места в одном шаге: ожидание first уже отменено,
+        # но из очереди его уберёт только следующий шаг задачи
+        first.cancel()
+        admission._release()
+
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await asyncio.wait_for(second, 1)
+        assert admission.inflight == 1
+        assert not any(admission.queues.values())
+
+        admission._release()
+        assert admission.inflight == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_limit_applies_to_every_model_call():
+    async def scenario():
+        admission = AdmissionController(1, 2, {"interactive": 1, "batch": 1})
+        await admission._acquire("batch")  # держит единственное место
+        waiting = [asyncio.create_task(admission._acquire("batch")) for _ in range(2)]
+        await asyncio.sleep(0)  # очередь batch заполнена
+
+        # следующий ход уже принятого запроса или промпт пакета в очередь не встаёт
+        with pytest.raises(HTTPException) as rejected:
+            await admission._acquire("batch")
+        assert rejected.value.status_code == 429
+        assert len(admission.queues["batch"]) == 2
+        # пакет из трёх одновременных промптов не помещается и в пустую очередь
+        with pytest.raises(HTTPException):
+            admission.admit("interactive", 3)
+
+        for task in waiting:
+            admission._release()
+            await asyncio.wait_for(task, 1)
+        admission._release()
+        assert admission.inflight == 0
+
+    asyncio.run(scenario())
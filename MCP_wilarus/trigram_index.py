@@ -0,0 +1,178 @@
+"""Триграммный индекс для нечёткого поиска номенклатуры по наименованию."""
+import math
+from array import array
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+
+# во втором круге список читается целиком, если он не длиннее READ_FACTOR × число кандидатов:
+# поштучный searchsorted по такому списку выходит дороже
+READ_FACTOR = 4
+
+
+def normalize(text: str) -> str:
+    return " ".join(str(text).casefold().split())
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {normalize(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Инвертированный индекс триграмм, пополняется по одной записи при создании.
+
+    Поиск возвращает k записей с наибольшим коэффициентом Жаккара между множествами
+    триграмм запроса и наименования — точный top-k, как при полном переборе. Списки триграмм
+    запроса читаются от самых коротких; совпадающие списки (так бывает у триграмм одного слова)
+    читаются один раз с весом.
+    Совпадения считаются в numpy поверх списков array("i") без копирования, пока кандидатов —
+    записей, где нашлись все прочитанные триграммы, кроме не более slack, — не станет
+    не больше max_candidates. Их пересечения досчитываются по остальным спискам (searchsorted),
+    и k-я оценка даёт границу: записи, которые даже со всеми непрочитанными триграммами её
+    не достигнут, отбрасываются, а остальные дочитываются и проверяются вторым кругом.
+    Время поиска зависит от данных: чем больше у запроса частых триграмм и чем ниже k-я
+    оценка, тем шире второй круг. На справочнике bench_fuzzy.py медиана — около 3 мс
+    на 10^5 записей и 15–20 мс на 10^6, не доли миллисекунды."""
+
+    def __init__(self, max_candidates: int = 3_000, slack: int = 3):
+        self.max_candidates = max_candidates
+        self.slack = slack
+        self._postings: Dict[str, array] = {}
+        self._keys: List[str] = []
+        self._sizes = array("H")  # число триграмм наименования — знаменатель Жаккара
+        self._counts = np.zeros(0, dtype=np.uint16)  # рабочий массив счётчиков, обнуляется после поиска
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str, text: str) -> None:
+        pos = len(self._keys)
+        grams = trigrams(text)
+        self._keys.append(key)
+        self._sizes.append(min(len(grams), 0xFFFF))
+        for gram in grams:
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array("i")
+            postings.append(pos)
+
+    def search(self, text: str, k: int = 5, min_score: float = 0.0) -> List[Tuple[str, float]]:
+        """Top-k записей, похожих на text: [(key, score)] по убыванию score (0..1)."""
+        query = trigrams(text)
+        groups: Dict[tuple, list] = {}
+        for postings in (self._postings.get(g) for g in query):
+            if postings:
+                # подпись только отсеивает заведомо разные списки — одинаковость проверяется целиком
+                signature = (len(postings), postings[0], postings[len(postings) // 2], postings[-1])
+                same = groups.setdefault(signature, [])
+                for group in same:
+                    if group[0] == postings:
+                        group[1] += 1
+                        break
+                else:
+                    same.append([postings, 1])
+        if not groups:
+            return []
+        groups_by_len = sorted((group for same in groups.values() for group in same), key=lambda group: len(group[0]))
+        # views держат буферы array: до их освобождения add() не сможет расширить списки,
+        # поэтому поиск остаётся синхронным и views не переживают этот вызов
+        views = [np.frombuffer(postings, dtype=np.int32) for postings, _ in groups_by_len]
+        weights = [weight for _, weight in groups_by_len]
+
+        size = len(self._keys)
+        if len(self._counts) < size:
+            self._counts = np.zeros(2 * size, dtype=np.uint16)
+        counts = self._counts[:size]
+        try:
+            # 1) первый круг: записи, где нашлись почти все прочитанные триграммы
+            total = 0
+            candidates = None
+            for read, (view, weight) in enumerate(zip(views, weights), 1):
+                counts[view] += weight
+                total += weight
+                last = read == len(views)
+                # пока прочитано мало, почти любая запись проходит порог — не сканируем счётчики зря
+                if total <= 2 * self.slack and not last:
+                    continue
+                threshold = max(1, total - self.slack)
+                if candidates is not None:
+                    # порог вырос на вес списка, а счётчик — не больше чем на него же:
+                    # новые кандидаты — часть прежних
+                    candidates = candidates[counts[candidates] >= threshold]
+                elif last or np.count_nonzero(counts >= threshold) <= self.max_candidates:
+                    # номера достаются из счётчиков, только когда их немного: flatnonzero
+                    # по плотной маске на порядок дороже подсчёта
+                    candidates = np.flatnonzero(counts >= threshold)
+                else:
+                    continue
+                # похожих меньше k (запрос искажён или совпадение уникально) — понижаем порог
+                while len(candidates) < k and threshold > 1:
+                    threshold -= 1
+                    candidates = np.flatnonzero(counts >= threshold)
+                if len(candidates) >= k or last:
+                    break
+            first = candidates
+            if len(first) > self.max_candidates and read < len(views):
+                best = np.argpartition(-counts[first], self.max_candidates - 1)[:self.max_candidates]
+                first = first[np.sort(best)]  # searchsorted быстрее на упорядоченных ключах
+            found, scores = self._verify(views[read:], weights[read:], first, counts[first], len(query), k, min_score)
+
+            # 2) k-я оценка — граница: запись достигнет её, только если пересечение не меньше
+            #    need (Жаккар не больше overlap / len(query)); у не попавших в первый круг
+            #    пересечение не больше счётчика плюс вес непрочитанных списков
+            bar = max(min_score, np.partition(scores, len(scores) - k)[len(scores) - k] if len(scores) >= k else 0.0)
+            need = max(1, math.ceil(bar * len(query) - 1e-9))
+            rest = sum(weights[read:])
+            if len(first) < len(candidates) or (threshold - 1) + rest >= need:
+                # непрочитанные списки дочитываются, пока запись без единого совпадения
+                # в прочитанных ещё может набрать need
+                while read < len(views) and rest >= need:
+                    counts[views[read]] += weights[read]
+                    rest -= weights[read]
+                    read += 1
+                counts[first] = 0  # первый круг уже проверен
+                # следующий список дешевле прочитать целиком, чем искать в нём каждого кандидата
+                while read < len(views) and len(views[read]) <= READ_FACTOR * np.count_nonzero(counts >= need - rest):
+                    counts[views[read]] += weights[read]
+                    rest -= weights[read]
+                    read += 1
+                second = np.flatnonzero(counts >= need - rest)
+                more, more_scores = self._verify(views[read:], weights[read:], second, counts[second], len(query), k, bar)
+                found, scores = np.concatenate([found, more]), np.concatenate([scores, more_scores])
+        finally:
+            counts[:] = 0
+            del views
+
+        top = np.lexsort((found, -scores))[:k]  # при равных оценках — раньше добавленные
+        return [
+            (self._keys[pos], round(score, 4))
+            for pos, score in zip(found[top].tolist(), scores[top].tolist())
+            if score >= min_score
+        ]
+
+    def _verify(self, views, weights, candidates, overlap, query_size: int, k: int, floor: float):
+        """Досчитывает пересечения кандидатов по спискам views; перед каждым списком отбрасывает
+        кандидатов, которые по верхней оценке уже не достигнут floor или k-й нижней оценки.
+        Возвращает (кандидаты, точные оценки Жаккара)."""
+        # ключи того же типа, что списки: иначе searchsorted копирует каждый список в int64
+        candidates = candidates.astype(np.int32)
+        overlap = overlap.astype(np.int32)
+        sizes = np.frombuffer(self._sizes, dtype=np.uint16)[candidates].astype(np.int32)
+        rest = sum(weights)
+        pending = zip(views, weights)
+        while len(candidates):
+            best = np.minimum(overlap + rest, sizes)
+            bar = floor
+            if len(candidates) > k:
+                lower = overlap / (query_size + sizes - overlap)
+                bar = max(bar, np.partition(lower, len(lower) - k)[len(lower) - k])
+            alive = best / (query_size + sizes - best) >= bar
+            candidates, overlap, sizes = candidates[alive], overlap[alive], sizes[alive]
+            view, weight = next(pending, (None, 0))
+            if view is None:
+                break
+            found = np.searchsorted(view, candidates)
+            overlap += weight * (view[np.minimum(found, len(view) - 1)] == candidates)
+            rest -= weight
+        return candidates, overlap / (query_size + sizes - overlap)
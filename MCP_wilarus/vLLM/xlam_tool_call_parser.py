@@ -112,44 +112,39 @@ class xLAMToolParser(ToolParser):
             current_token_ids: Sequence[int],
             delta_token_ids: Sequence[int],
             request: ChatCompletionRequest,
-    ) -> Union[DeltaMessage, ExtractedToolCallInformation, None]:
-        if current_text.endswith("]"):
-            try:
-                json_str = self.extract_first_json(current_text)
-                print('model_output', current_text)
-                if not json_str:
-                    return ExtractedToolCallInformation(
-                        tools_called=False,
-                        tool_calls=[],
-                        content=model_output
-                    )
-                print('json_str', json_str)
-                json_str = '[' + json_str + ']'
-                tool_calls_data = json.loads(json_str)
-                tool_calls: List[ToolCall] = []
-                for idx, call in enumerate(tool_calls_data):
-                    tool_call = ToolCall(
-                        id=f"call_{idx}_{random_uuid()}",
-                        type="function",
-                        function=FunctionCall(
-                            name=call["name"],
-                            arguments=json.dumps(call["arguments"])
-                        )
-                    )
-                    tool_calls.append(tool_call)
-
-                return ExtractedToolCallInformation(
-                    tools_called=True,
-                    tool_calls=tool_calls,
-                    content=model_output
-                )
-
-            except Exception:
-                logger.exception("Error extracting tool calls")
-                return ExtractedToolCallInformation(
-                    tools_called=False,
-                    tool_calls=[],
-                    content=model_output
-                )
-        else:
-            return DeltaMessage(delta_text)
+    ) -> Union[DeltaMessage, None]:
+        stripped = current_text.lstrip()
+        if not stripped:
+            return None
+        # Plain answer: stream the text as is
+        if stripped[0] not in "{[":
+            return DeltaMessage(content=delta_text)
+        # The call has already been sent; the tail (e.g. the closing "]") is not content
+        if self.current_tools_sent:
+            return None
+        # Tool call JSON: hold the deltas until the first object is complete, then send it whole
+        json_str = self.extract_first_json(current_text)
+        if not json_str:
+            return None
+        self.current_tools_sent = [True]
+        try:
+            call = json.loads(json_str)
+            name = call["name"]
+            arguments = json.dumps(call.get("arguments", {}))
+        except (KeyError, TypeError):
+            logger.exception("Error extracting tool calls")
+            # not a tool call after all: give back everything held so far
+            return DeltaMessage(content=current_text)
+        # the serving layer uses these to set finish_reason="tool_calls" and to check
+        # that all arguments were streamed
+        self.prev_tool_call_arr = [{"name": name, "arguments": call.get("arguments", {})}]
+        self.streamed_args_for_tool = [arguments]
+        self.current_tool_id = 0
+        return DeltaMessage(tool_calls=[
+            DeltaToolCall(
+                index=0,
+                id=f"call_0_{random_uuid()}",
+                type="function",
+                function=DeltaFunctionCall(name=name, arguments=arguments).model_dump(exclude_none=True),
+            )
+        ])
@@ -0,0 +1,168 @@
+"""
+Бенчмарк: сколько одновременных /chat выдерживает llm_server.
+Поднимает локальную заглушку OpenAI-совместимого API (vLLM) и MCP server:
+модель «думает» --delay секунд, на первый ход просит инструмент, на второй отвечает текстом.
+Сравнивает прежний синхронный клиент OpenAI (блокирует цикл событий) с асинхронным пулом.
+Запуск:
+    python bench_llm_server.py --requests 50 --concurrency 10 --delay 0.2
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+MOCK_PORT = int(os.getenv("BENCH_MOCK_PORT", "9200"))
+LLM_PORT = int(os.getenv("BENCH_LLM_PORT", "9201"))
+LEGACY_PORT = int(os.getenv("BENCH_LEGACY_PORT", "9202"))
+os.environ.setdefault("LLM_SERVER_URL", f"http://127.0.0.1:{MOCK_PORT}/v1")
+os.environ.setdefault("MCP_SERVER_URL", f"http://127.0.0.1:{MOCK_PORT}")
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from openai import OpenAI
+
+import llm_server
+
+DELAY = 0.2
+mock = FastAPI()
+
+
+def completion(message: dict, finish_reason: str) -> dict:
+    return {
+        "id": "bench",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": "bench",
+        "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    }
+
+
+def chunks(message: dict, finish_reason: str, usage: bool = False):
+    """Тот же ответ в виде SSE-потока chat.completion.chunk, как при stream=True;
+    с usage — последним чанком идёт расход токенов, как при stream_options.include_usage."""
+    delta = dict(message)
+    if "tool_calls" in delta:
+        delta["tool_calls"] = [{"index": i, **call} for i, call in enumerate(delta["tool_calls"])]
+    for choice in ({"index": 0, "delta": delta, "finish_reason": None},
+                   {"index": 0, "delta": {}, "finish_reason": finish_reason}):
+        chunk = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                 "model": "bench", "choices": [choice]}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    if usage:
+        chunk = {"id": "bench", "object": "chat.completion.chunk", "created": int(time.time()), "model": "bench",
+                 "choices": [], "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}}
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@mock.post("/v1/chat/completions")
+async def mock_completions(request: Request):
+    body = await request.json()
+    # time.sleep не годится: заглушка должна отвечать параллельно, как настоящий vLLM
+    await asyncio.sleep(DELAY)
+    if any(m["role"] in ("function", "tool") for m in body["messages"]):
+        message, finish_reason = {"role": "assistant", "content": "42"}, "stop"
+    else:
+        call = {"id": "call_0", "type": "function", "function": {"name": "get_data", "arguments": json.dumps({"q": 1})}}
+        message, finish_reason = {"role": "assistant", "content": None, "tool_calls": [call]}, "tool_calls"
+    if body.get("stream"):
+        usage = (body.get("stream_options") or {}).get("include_usage", False)
+        return StreamingResponse(chunks(message, finish_reason, usage), media_type="text/event-stream")
+    return completion(message, finish_reason)
+
+
+@mock.get("/get_tools")
+async def mock_tools():
+    return {"tools": []}
+
+
+@mock.post("/get_data")
+async def mock_get_data(request: Request):
+    return {"result": {"echo": await request.json()}}
+
+
+# Прежняя реализация: синхронный OpenAI внутри async-эндпоинта
+legacy = FastAPI()
+legacy_client = OpenAI(base_url=llm_server.LLM_BASE_URL, api_key="empty")
+
+
+@legacy.post("/chat")
+async def legacy_chat(request: llm_server.ChatRequest):
+    messages = [{"role": "user", "content": request.prompt}]
+    while True:
+        choice = legacy_client.chat.completions.create(model="", messages=messages, tools=request.tools or None).choices[0]
+        if choice.finish_reason != "tool_calls":
+            return {"response": choice.message.content}
+        call = choice.message.tool_calls[0]
+        async with httpx.AsyncClient() as client:
+            resp = await client.post(f"{llm_server.MCP_SERVER_URL}/get_data", json={"tool": call.function.name})
+        messages.append({"role": "function", "name": call.function.name, "content": resp.text})
+
+
+async def serve(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Заглушка живёт в своём потоке: синхронный клиент блокирует цикл событий процесса бенчмарка."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def run(url: str, requests: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+
+        async def one():
+            async with sem:
+                resp = await client.post(f"{url}/chat", json={"prompt": "сколько?", "tools": []})
+                resp.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return requests / (time.perf_counter() - started)
+
+
+async def main(requests: int, concurrency: int):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    mock_server = serve_in_thread(mock, MOCK_PORT)
+    servers = [
+        await serve(llm_server.app, LLM_PORT),
+        await serve(legacy, LEGACY_PORT),
+    ]
+    try:
+        await run(f"http://127.0.0.1:{LLM_PORT}", concurrency, concurrency)  # прогрев
+        before = await run(f"http://127.0.0.1:{LEGACY_PORT}", requests, concurrency)
+        after = await run(f"http://127.0.0.1:{LLM_PORT}", requests, concurrency)
+        print(f"requests={requests} concurrency={concurrency} delay={DELAY}s (2 хода LLM на запрос)")
+        print(f"  синхронный OpenAI:      {before:8.2f} /chat в секунду")
+        print(f"  AsyncOpenAI + пулы:     {after:8.2f} /chat в секунду  (x{after / before:.2f})")
+    finally:
+        for server, task in reversed(servers):
+            server.should_exit = True
+            await task
+        mock_server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=DELAY)
+    args = parser.parse_args()
+    DELAY = args.delay
+    asyncio.run(main(args.requests, args.concurrency))
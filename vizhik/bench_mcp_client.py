@@ -0,0 +1,105 @@
+"""
+Нагрузочный тест mcp_client: пропускная способность /process при разной конкуренции.
+Поднимает заглушку LLM server, у которой /chat отвечает через --delay секунд,
+и сравнивает прежний обработчик на блокирующем requests с асинхронным пулом httpx.
+Запуск:
+    python bench_mcp_client.py --requests 40 --delay 0.2 --concurrency 1 4 16
+"""
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+
+MOCK_PORT = int(os.getenv("BENCH_MOCK_PORT", "9210"))
+CLIENT_PORT = int(os.getenv("BENCH_CLIENT_PORT", "9211"))
+LEGACY_PORT = int(os.getenv("BENCH_LEGACY_PORT", "9212"))
+os.environ.setdefault("LLM_SERVER_URL", f"http://127.0.0.1:{MOCK_PORT}")
+
+import httpx
+import requests
+import uvicorn
+from fastapi import FastAPI
+
+import mcp_client
+
+DELAY = 0.2
+mock = FastAPI()
+
+
+@mock.post("/chat")
+async def mock_chat(request: mcp_client.PromptRequest):
+    await asyncio.sleep(DELAY)
+    return {"response": "42"}
+
+
+# Прежняя реализация: блокирующий requests внутри async-эндпоинта
+legacy = FastAPI()
+
+
+@legacy.post("/process")
+async def legacy_process(request: mcp_client.PromptRequest):
+    resp = requests.post(f"{mcp_client.LLM_SERVER_URL}/chat", json={"prompt": request.prompt})
+    resp.raise_for_status()
+    return {"response": resp.json()["response"]}
+
+
+def serve_in_thread(app, port: int) -> uvicorn.Server:
+    """Заглушка живёт в своём потоке: requests блокирует цикл событий процесса бенчмарка."""
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def serve(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    return server, task
+
+
+async def run(url: str, requests_count: int, concurrency: int) -> float:
+    sem = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency), timeout=None) as client:
+
+        async def one():
+            async with sem:
+                resp = await client.post(f"{url}/process", json={"prompt": "сколько?"})
+                resp.raise_for_status()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests_count)))
+        return requests_count / (time.perf_counter() - started)
+
+
+async def main(requests_count: int, levels: list):
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    mock_server = serve_in_thread(mock, MOCK_PORT)
+    servers = [await serve(mcp_client.app, CLIENT_PORT), await serve(legacy, LEGACY_PORT)]
+    try:
+        await run(f"http://127.0.0.1:{CLIENT_PORT}", 4, 4)  # прогрев
+        print(f"requests={requests_count} delay={DELAY}s, /process в секунду")
+        print(f"  {'конкуренция':>12} {'requests':>10} {'httpx пул':>10}")
+        for concurrency in levels:
+            before = await run(f"http://127.0.0.1:{LEGACY_PORT}", requests_count, concurrency)
+            after = await run(f"http://127.0.0.1:{CLIENT_PORT}", requests_count, concurrency)
+            print(f"  {concurrency:>12} {before:>10.2f} {after:>10.2f}")
+    finally:
+        for server, task in reversed(servers):
+            server.should_exit = True
+            await task
+        mock_server.should_exit = True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--delay", type=float, default=DELAY)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    args = parser.parse_args()
+    DELAY = args.delay
+    asyncio.run(main(args.requests, args.concurrency))
@@ -1,10 +1,27 @@
 # llm_server.py
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Literal, Optional
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 import os
 import json
 import httpx
-from openai import OpenAI  # pip install openai-python-sdk
+from openai import AsyncOpenAI  # pip install openai-python-sdk
+
+from metrics import (
+    CHAT_REQUESTS, CHAT_TURNS, LLM_COMPLETION_TOKENS, LLM_INFLIGHT, LLM_LATENCY, LLM_PROMPT_TOKENS,
+    LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT, LLM_REJECTED, LLM_TTFT,
+    TOOL_ERRORS, TOOL_LATENCY, TraceMiddleware, current_trace_id, inject_trace, log_stage, metrics_endpoint,
+    trace_id_var,
+)
+
+SERVICE = "llm_server"
 
 # === Настройки ===
 # URL, по которому у нас «отвечает» vLLM (совместимый с OpenAI-API)
@@ -13,113 +30,670 @@ LLM_BASE_URL = os.getenv("LLM_SERVER_URL", "http://0.0.0.0:8000/v1")
 # URL, по которому развернут ваш MCP server (тот, что уже создан на 9000)
 MCP_SERVER_URL = os.getenv("MCP_SERVER_URL", "http://localhost:9000")
 
-# === Инициализация FastAPI и клиента OpenAI/vLLM ===
-app = FastAPI(title="LLM Server")
+# Пулы соединений к vLLM и MCP server: одновременных /chat столько, сколько соединений в пуле
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "600"))
+MCP_MAX_CONNECTIONS = int(os.getenv("MCP_MAX_CONNECTIONS", "100"))
+MCP_TIMEOUT = float(os.getenv("MCP_TIMEOUT", "60"))
+# Сколько вызовов инструментов одного хода модели выполняются одновременно
+TOOL_CALLS_CONCURRENCY = int(os.getenv("TOOL_CALLS_CONCURRENCY", "8"))
+# Сколько секунд каталог инструментов считается свежим без перепроверки у MCP server
+TOOLS_CACHE_TTL = float(os.getenv("TOOLS_CACHE_TTL", "300"))
+# Сколько промптов /chat/batch гоняет одновременно (vLLM сам собирает их в батчи)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "32"))
+# Бюджет одного запроса по умолчанию: ходов модели, секунд и токенов (0 — без ограничения)
+CHAT_MAX_TURNS = int(os.getenv("CHAT_MAX_TURNS", "10"))
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "300"))
+CHAT_MAX_TOKENS = int(os.getenv("CHAT_MAX_TOKENS", "0"))
+# Допуск к vLLM: сколько вызовов модели выполняется одновременно, сколько может ждать
+# в очереди каждого класса (дальше — 429) и веса классов при разборе очереди
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "64"))
+LLM_QUEUE_LIMIT = int(os.getenv("LLM_QUEUE_LIMIT", "256"))
+ADMISSION_WEIGHTS = {
+    name: int(weight)
+    for name, weight in (item.split(":") for item in os.getenv("ADMISSION_WEIGHTS", "interactive:4,batch:1").split(","))
+}
+
+Priority = Literal["interactive", "batch"]
 
-# Клиент, который будет стучаться в vLLM (OpenAI-совместимый)
-llm_client = OpenAI(
+# Асинхронный клиент, который будет стучаться в vLLM (OpenAI-совместимый).
+# Пока модель генерирует ответ, цикл событий свободен и обслуживает другие запросы.
+llm_client = AsyncOpenAI(
     base_url=LLM_BASE_URL,
-    api_key="empty"  # vLLM обычно не проверяет API-ключ, поэтому «empty»
+    api_key="empty",  # vLLM обычно не проверяет API-ключ, поэтому «empty»
+    timeout=LLM_TIMEOUT,
+    http_client=httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS),
+        timeout=LLM_TIMEOUT,
+        event_hooks={"request": [inject_trace]},
+    ),
 )
 
+# Общий клиент к MCP server вместо нового соединения на каждый вызов инструмента
+mcp_http = httpx.AsyncClient(
+    base_url=MCP_SERVER_URL,
+    limits=httpx.Limits(max_connections=MCP_MAX_CONNECTIONS, max_keepalive_connections=MCP_MAX_CONNECTIONS),
+    timeout=MCP_TIMEOUT,
+    event_hooks={"request": [inject_trace]},
+)
+
+
+class ToolCatalog:
+    """
+    Каталог инструментов MCP server в памяти. По истечении TOOLS_CACHE_TTL перепроверяется
+    условным запросом If-None-Match: при 304 остаётся прежним. version — ETag MCP server,
+    а если он его не отдаёт — хэш содержимого, так что клиенты llm_server тоже могут
+    перепроверять каталог по ETag.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.tools: Optional[list] = None
+        self.version: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.checked_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> list:
+        if self.tools is not None and time.monotonic() - self.checked_at < self.ttl:
+            return self.tools
+        # один запрос на перепроверку, остальные ждут его результата
+        async with self._lock:
+            if self.tools is None or time.monotonic() - self.checked_at >= self.ttl:
+                await self._revalidate()
+            return self.tools
+
+    def invalidate(self) -> None:
+        self.checked_at = 0.0
+
+    async def _revalidate(self) -> None:
+        headers = {"If-None-Match": self.etag} if self.tools is not None and self.etag else {}
+        resp = await mcp_http.get("/get_tools", headers=headers)
+        if resp.status_code != 304:
+            resp.raise_for_status()
+            self.tools = resp.json().get("tools", [])  # ожидается формат {"tools": [ … ]}
+            self.etag = resp.headers.get("ETag")
+            digest = hashlib.sha256(json.dumps(self.tools, sort_keys=True).encode()).hexdigest()[:16]
+            self.version = self.etag or f'"{digest}"'
+        self.checked_at = time.monotonic()
+
+
+tool_catalog = ToolCatalog(TOOLS_CACHE_TTL)
+
+
+class AdmissionController:
+    """
+    Допуск вызовов модели к vLLM: не больше capacity одновременно, остальные ждут
+    в очереди своего класса приоритета. Освободившееся место достаётся очередям по
+    взвешенному round-robin (smooth weighted round-robin, как в nginx): при весах 4:1
+    interactive получает 4 места из 5, но batch не голодает. Очередь класса не длиннее
+    queue_limit: вызов модели, которому в ней нет места, — будь то первый ход запроса,
+    следующий ход или промпт пакета — получает 429 с Retry-After.
+    """
+
+    def __init__(self, capacity: int, queue_limit: int, weights: dict):
+        self.capacity = capacity
+        self.queue_limit = queue_limit
+        self.weights = weights
+        self.inflight = 0
+        self.queues = {priority: deque() for priority in weights}
+        self._current = {priority: 0 for priority in weights}
+        self.avg_call = 1.0  # скользящее среднее длительности вызова модели — для Retry-After
+
+    def admit(self, priority: str, count: int = 1) -> None:
+        """Проверка при входе запроса: HTTPException 429, если в очереди класса нет места
+        ещё на count ожиданий (у пакета — по одному на каждый одновременно идущий промпт)."""
+        if len(self.queues[priority]) + count > self.queue_limit:
+            self._reject(priority)
+
+    def _reject(self, priority: str) -> None:
+        LLM_REJECTED.labels(priority).inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Очередь {priority} к модели заполнена",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    def retry_after(self) -> int:
+        queued = sum(len(queue) for queue in self.queues.values())
+        return max(1, math.ceil((queued / self.capacity + 1) * self.avg_call))
+
+    @asynccontextmanager
+    async def slot(self, priority: str, budget: "ChatBudget"):
+        """Место для одного вызова модели; ожидание в очереди считается в deadline запроса."""
+        await budget.wait(self._acquire(priority))
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.avg_call = 0.9 * self.avg_call + 0.1 * (time.perf_counter() - started)
+            self._release()
+
+    async def _acquire(self, priority: str) -> None:
+        if self.inflight < self.capacity and not any(self.queues.values()):
+            self.inflight += 1
+            LLM_INFLIGHT.set(self.inflight)
+            LLM_QUEUE_WAIT.labels(priority).observe(0)
+            return
+        queue = self.queues[priority]
+        # admit проверяет очередь один раз на HTTP-запрос, а ходов и промптов пакета в нём много
+        if len(queue) >= self.queue_limit:
+            self._reject(priority)
+        waiter = asyncio.get_running_loop().create_future()
+        queue.append(waiter)
+        LLM_QUEUE_DEPTH.labels(priority).set(len(queue))
+        started = time.perf_counter()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()  # место уже выдали, но запрос отменили
+            elif waiter in queue:  # _release мог уже выбросить отменённое ожидание из очереди
+                queue.remove(waiter)
+                LLM_QUEUE_DEPTH.labels(priority).set(len(queue))
+            raise
+        finally:
+            LLM_QUEUE_WAIT.labels(priority).observe(time.perf_counter() - started)
+
+    def _release(self) -> None:
+        self.inflight -= 1
+        while self.inflight < self.capacity:
+            # отменённые ожидания уходят из очереди только на следующем шаге своей задачи —
+            # место им не выдаём и в inflight не считаем
+            for priority, queue in self.queues.items():
+                for waiter in [waiter for waiter in queue if waiter.done()]:
+                    queue.remove(waiter)
+                LLM_QUEUE_DEPTH.labels(priority).set(len(queue))
+            ready = [priority for priority, queue in self.queues.items() if queue]
+            if not ready:
+                break
+            total = sum(self.weights[priority] for priority in ready)
+            for priority in ready:
+                self._current[priority] += self.weights[priority]
+            chosen = max(ready, key=self._current.__getitem__)
+            self._current[chosen] -= total
+            waiter = self.queues[chosen].popleft()
+            LLM_QUEUE_DEPTH.labels(chosen).set(len(self.queues[chosen]))
+            self.inflight += 1
+            waiter.set_result(None)
+        LLM_INFLIGHT.set(self.inflight)
+
+
+admission = AdmissionController(LLM_MAX_INFLIGHT, LLM_QUEUE_LIMIT, ADMISSION_WEIGHTS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await mcp_http.aclose()
+    await llm_client.close()
+
+
+# === Инициализация FastAPI ===
+app = FastAPI(title="LLM Server", lifespan=lifespan)
+# trace id между mcp_client → llm_server → MCP server и метрики Prometheus на /metrics
+app.add_middleware(TraceMiddleware, service=SERVICE)
+app.add_route("/metrics", metrics_endpoint, methods=["GET"])
+
 # === Pydantic‐модели ===
-class ChatRequest(BaseModel):
+class BudgetRequest(BaseModel):
+    # Бюджет на один промпт; не задано — CHAT_MAX_TURNS / CHAT_DEADLINE / CHAT_MAX_TOKENS
+    max_turns: Optional[int] = None
+    deadline: Optional[float] = None
+    max_tokens: Optional[int] = None
+    # Класс приоритета при допуске к модели: interactive — пользователи, batch — пакетные задания
+    priority: Optional[Priority] = None
+
+    def budget(self) -> "ChatBudget":
+        return ChatBudget(
+            CHAT_MAX_TURNS if self.max_turns is None else self.max_turns,
+            CHAT_DEADLINE if self.deadline is None else self.deadline,
+            CHAT_MAX_TOKENS if self.max_tokens is None else self.max_tokens,
+            self.priority,
+        )
+
+
+class ChatRequest(BudgetRequest):
+    priority: Priority = "interactive"
     prompt: str
-    # Список описаний функций (инструментов), которые LLM может вызвать
-    tools: list
+    # Список описаний функций (инструментов), которые LLM может вызвать;
+    # если не передан — берётся кэшированный каталог MCP server
+    tools: Optional[list] = None
+    # Отдавать события по мере появления (NDJSON) вместо одного ответа в конце
+    stream: bool = False
 
 
-@app.get("/get_tools")
-async def get_tools():
+class BatchChatRequest(BudgetRequest):
+    priority: Priority = "batch"
+    prompts: List[str]
+    tools: Optional[list] = None
+    # Не больше BATCH_CONCURRENCY; по умолчанию — BATCH_CONCURRENCY
+    concurrency: Optional[int] = None
+
+
+class BudgetExceeded(Exception):
+    def __init__(self, reason: str, partial: str = ""):
+        super().__init__(reason)
+        self.reason = reason  # max_turns, deadline или max_tokens
+        self.partial = partial  # текст, который модель успела сгенерировать в прерванном ходе
+
+
+class ChatBudget:
     """
-    Возвращает MCP server’у список всех доступных инструментов.
-    MCP client при старте звонит сюда, чтобы получить tools и передать их в vLLM.
+    Бюджет одного запроса: ходы модели, время с начала запроса и токены
+    (prompt + completion по usage vLLM); 0 — без ограничения.
+    priority — класс запроса при допуске к модели.
     """
-    async with httpx.AsyncClient() as client:
+
+    def __init__(self, max_turns: int, deadline: float, max_tokens: int, priority: str = "interactive"):
+        self.max_turns = max_turns
+        self.deadline = deadline
+        self.max_tokens = max_tokens
+        self.priority = priority
+        self.started = time.monotonic()
+        self.turns = 0
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining_time(self) -> Optional[float]:
+        return max(0.0, self.deadline - self.elapsed()) if self.deadline else None
+
+    def remaining_tokens(self) -> Optional[int]:
+        return max(0, self.max_tokens - self.total_tokens) if self.max_tokens else None
+
+    def check(self) -> None:
+        """Перед следующим ходом модели: BudgetExceeded, если продолжать нельзя."""
+        if self.max_turns and self.turns >= self.max_turns:
+            raise BudgetExceeded("max_turns")
+        if self.deadline and self.remaining_time() <= 0:
+            raise BudgetExceeded("deadline")
+        if self.max_tokens and self.remaining_tokens() <= 0:
+            raise BudgetExceeded("max_tokens")
+
+    async def wait(self, awaitable):
+        """Ждёт awaitable не дольше оставшегося времени; по истечении — BudgetExceeded("deadline")."""
         try:
-            # Запрашиваем у «вашего» MCP server’а (порт 9000) список
-            # функций, доступных для вызова (ваша реализация в вопросе).
-            resp = await client.get(f"{MCP_SERVER_URL}/get_tools")
-            resp.raise_for_status()
-            data = resp.json()
-            return data  # ожидается формат {"tools": [ … ]}
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка при get_tools: {e}")
+            return await asyncio.wait_for(awaitable, self.remaining_time())
+        except asyncio.TimeoutError:
+            raise BudgetExceeded("deadline")
 
+    def stats(self) -> dict:
+        return {
+            "turns": self.turns,
+            "max_turns": self.max_turns,
+            "tool_calls": self.tool_calls,
+            "elapsed": round(self.elapsed(), 3),
+            "deadline": self.deadline,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "max_tokens": self.max_tokens,
+        }
 
-@app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+
+async def cached_tools() -> list:
+    try:
+        # Список функций, доступных для вызова, у «вашего» MCP server’а (порт 9000) —
+        # из кэша, к MCP server идём только после TOOLS_CACHE_TTL.
+        return await tool_catalog.get()
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при get_tools: {e}")
+
+
+@app.get("/get_tools")
+async def get_tools(request: Request, response: Response, refresh: bool = False):
     """
-    Основной эндпоинт: принимает { prompt, tools }, делает первый запрос в vLLM,
-    смотрит, есть ли function_call. Если он есть — дозванивается до MCP server
-    за результатом функции, затем отправляет второй запрос в vLLM, чтобы получить финальный
-    ответ. Возвращает MCP client’у JSON {"response": "..."}.
+    Возвращает список всех доступных инструментов {"tools": [...], "version": ...}
+    с заголовком ETag. С If-None-Match той же версии отвечает 304 без тела;
+    refresh=true перечитывает каталог у MCP server сразу, не дожидаясь TTL.
     """
-    prompt_text = request.prompt
-    tools = request.tools  # это список dict’ов с описаниями функций (schema json‐schema)
+    if refresh:
+        tool_catalog.invalidate()
+    tools = await cached_tools()
+    if request.headers.get("If-None-Match") == tool_catalog.version:
+        return Response(status_code=304, headers={"ETag": tool_catalog.version})
+    response.headers["ETag"] = tool_catalog.version
+    return {"tools": tools, "version": tool_catalog.version}
+
 
+def count_usage(budget: ChatBudget, usage) -> None:
+    budget.prompt_tokens += usage.prompt_tokens
+    budget.completion_tokens += usage.completion_tokens
+    LLM_PROMPT_TOKENS.observe(usage.prompt_tokens)
+    LLM_COMPLETION_TOKENS.observe(usage.completion_tokens)
+
+
+async def stream_turn(messages: list, tools: list, budget: ChatBudget, stream: bool = True):
+    """
+    Один ход модели. Со stream=True по мере генерации отдаёт события
+    {"type": "token", "content": ...}, а в конце — служебное
+    {"type": "turn", "content": ..., "tool_calls": [...], "finish_reason": ...},
+    в котором tool_calls собраны из дельт по index. Со stream=False (обычный /chat) модель
+    вызывается без потока и приходит только turn. Расход токенов пишется в budget;
+    по истечении времени ход прерывается с BudgetExceeded("deadline", <текст хода>).
+    """
+    extra_body = {"min_tokens": 5}
+    limits = {}
+    remaining_tokens = budget.remaining_tokens()
+    if remaining_tokens is not None:
+        limits["max_tokens"] = remaining_tokens
+        extra_body["min_tokens"] = min(5, remaining_tokens)
+    content = []
+    calls = {}
+    finish_reason = None
+    chunk_stream = None
+    started, wall = time.perf_counter(), time.time()
+    first_token = None
+    usage = None
+    try:
+        if not stream:
+            resp = await budget.wait(llm_client.chat.completions.create(
+                model="",
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                extra_body=extra_body,
+                **limits
+            ))
+            usage = resp.usage
+            if usage:
+                count_usage(budget, usage)
+            choice = resp.choices[0]
+            content.append(choice.message.content or "")
+            for i, call in enumerate(choice.message.tool_calls or []):
+                calls[i] = {"id": call.id, "name": call.function.name, "arguments": call.function.arguments or ""}
+            finish_reason = choice.finish_reason
+        else:
+            chunk_stream = await budget.wait(llm_client.chat.completions.create(
+                model="",
+                messages=messages,
+                tools=tools,
+                tool_choice="auto",
+                extra_body=extra_body,
+                stream=True,
+                stream_options={"include_usage": True},
+                **limits
+            ))
+            chunks = chunk_stream.__aiter__()
+            streamed = 0
+            while (chunk := await budget.wait(anext(chunks, None))) is not None:
+                usage = chunk.usage or usage
+                if not chunk.choices:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                    LLM_TTFT.observe(first_token)
+                streamed += 1
+                choice = chunk.choices[0]
+                delta = choice.delta
+                if delta.content:
+                    content.append(delta.content)
+                    yield {"type": "token", "content": delta.content}
+                for part in delta.tool_calls or []:
+                    call = calls.setdefault(part.index, {"id": None, "name": "", "arguments": ""})
+                    call["id"] = part.id or call["id"]
+                    if part.function and part.function.name:
+                        call["name"] += part.function.name
+                    if part.function and part.function.arguments:
+                        call["arguments"] += part.function.arguments
+                finish_reason = choice.finish_reason or finish_reason
+            if usage:
+                count_usage(budget, usage)
+            else:
+                # vLLM без include_usage: считаем хотя бы сгенерированное, по токену на чанк
+                budget.completion_tokens += streamed
+    except BudgetExceeded as e:
+        e.partial = "".join(content)
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при обращении к vLLM: {e}")
+    finally:
+        if chunk_stream is not None:
+            await chunk_stream.close()
+        LLM_LATENCY.observe(time.perf_counter() - started)
+        log_stage(
+            SERVICE, "llm_turn", wall, turn=budget.turns, ttft=first_token,
+            prompt_tokens=usage.prompt_tokens if usage else None,
+            completion_tokens=usage.completion_tokens if usage else None,
+        )
+
+    yield {
+        "type": "turn",
+        "content": "".join(content),
+        "tool_calls": [calls[i] for i in sorted(calls)],
+        "finish_reason": finish_reason,
+    }
+
+
+async def call_tool(tool_name: str, func_args: dict):
+    """
+    Вызывает MCP server и возвращает результат функции:
+    POST http://localhost:9000/get_data {"tool":tool_name, "parameters":func_args}
+    """
+    # время вызова вместе с HTTP-переходом; исполнение самого инструмента MCP server
+    # замеряет у себя — разница и есть накладные расходы на переход
+    started, wall = time.perf_counter(), time.time()
+    try:
+        tool_req = {"tool": tool_name, "parameters": func_args}
+        resp = await mcp_http.post("/get_data", json=tool_req)
+        resp.raise_for_status()
+        return resp.json()["result"]
+    except httpx.HTTPStatusError as he:
+        TOOL_ERRORS.labels(SERVICE, tool_name).inc()
+        code = he.response.status_code
+        detail = he.response.json().get("detail", he.response.text)
+        raise HTTPException(status_code=code, detail=f"Ошибка MCP server при {tool_name}: {detail}")
+    except Exception as e:
+        TOOL_ERRORS.labels(SERVICE, tool_name).inc()
+        raise HTTPException(status_code=500, detail=f"Ошибка при get_data: {e}")
+    finally:
+        TOOL_LATENCY.labels(SERVICE, tool_name).observe(time.perf_counter() - started)
+        log_stage(SERVICE, "tool", wall, tool=tool_name)
+
+
+async def run_chat(prompt_text: str, tools: list, budget: ChatBudget, stream: bool = False):
+    """
+    Цикл «модель → инструмент → модель» в виде потока событий:
+    token — очередной фрагмент ответа модели, tool_call — модель вызвала инструмент,
+    tool_result — ответ MCP server, done — финальный ответ
+    {"response": ..., "stop_reason": ..., "usage": {...}}.
+    Когда бюджет исчерпан, незавершённые вызовы инструментов отменяются, а done приходит
+    с последним текстом модели и stop_reason max_turns / deadline / max_tokens.
+    Ошибки поднимаются как HTTPException. token приходят только со stream=True —
+    без него модель вызывается без потока.
+    """
     # 1) Составляем «начальные» сообщения для vLLM
     messages = [
         {"role": "system", "content": "You are a helpful assistant that can use tools."},
         {"role": "user", "content": prompt_text}
     ]
+    answer = ""  # последний текст модели — частичный ответ, если бюджет кончится
+    stop_reason = "error"
+    try:
+        async for event in run_turns(messages, tools, budget, stream):
+            if event["type"] == "turn":
+                answer = event["content"] or answer
+                continue
+            if event["type"] == "done":
+                stop_reason = event["stop_reason"]
+            yield event
+    except BudgetExceeded as e:
+        stop_reason = e.reason
+        yield {"type": "done", "response": e.partial or answer, "stop_reason": e.reason, "usage": budget.stats()}
+    finally:
+        CHAT_TURNS.observe(budget.turns)
+        CHAT_REQUESTS.labels(stop_reason).inc()
+
+
+async def run_turns(messages: list, tools: list, budget: ChatBudget, stream: bool):
     while True:
-        try:
-            # 2) Первый запрос в vLLM (с инструментами, tool_choice="auto").
-            completion = llm_client.chat.completions.create(
-                model="",
-                messages=messages,
-                tools=tools,
-                tool_choice="auto",
-                extra_body={"min_tokens": 5},
-                stream=False
-            )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Ошибка при обращении к vLLM: {e}")
-
-        # 3) Проверяем, не захотел ли LLM вызвать функцию
-        first_choice = completion.choices[0]
-        finish_reason = first_choice.finish_reason
-        print(first_choice)
-        # Если vLLM не вернул function_call, значит — просто обычный текст
-        if finish_reason != "tool_calls":
-            text = first_choice.message.content
-            return {"response": text}
-
-        # === Если пришёл function_call ===
-        tool_calls = getattr(first_choice.message, "tool_calls", None)
-        call = tool_calls[0]
-        tool_name = call.function.name
-        # Аргументы функции — это JSON строка, разбираем её
-        func_args = json.loads(call.function.arguments or "{}")
-
-        # 4) Вызываем MCP server, чтобы получить результат функции
-        #    POST http://localhost:9000/get_data {"tool":tool_name, "parameters":func_args}
-        async with httpx.AsyncClient() as client:
+        # 2) Запрос в vLLM (с инструментами, tool_choice="auto"), токены уходят клиенту сразу
+        budget.check()
+        budget.turns += 1
+        async with admission.slot(budget.priority, budget):
+            async for event in stream_turn(messages, tools, budget, stream):
+                yield event
+        turn = event
+
+        # 3) Если vLLM не вернул function_call, значит — просто обычный текст
+        if turn["finish_reason"] != "tool_calls" or not turn["tool_calls"]:
+            yield {"type": "done", "response": turn["content"], "stop_reason": "finished", "usage": budget.stats()}
+            return
+        # на ответ по результатам инструментов бюджета уже не хватит — не вызываем их
+        budget.check()
+
+        # === Если пришли function_call — выполняем все вызовы хода сразу ===
+        calls = turn["tool_calls"]
+        for i, call in enumerate(calls):
+            call["id"] = call["id"] or f"call_{i}"
+            # Аргументы функции — это JSON строка, разбираем её
             try:
-                tool_req = {"tool": tool_name, "parameters": func_args}
-                resp = await client.post(f"{MCP_SERVER_URL}/get_data", json=tool_req)
-                resp.raise_for_status()
-                tool_result = resp.json()["result"]
-            except httpx.HTTPStatusError as he:
-                code = he.response.status_code
-                detail = he.response.json().get("detail", he.response.text)
-                raise HTTPException(status_code=code, detail=f"Ошибка MCP server при {tool_name}: {detail}")
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Ошибка при get_data: {e}")
+                call["parsed"] = json.loads(call["arguments"] or "{}")
+            except json.JSONDecodeError as e:
+                TOOL_ERRORS.labels(SERVICE, call["name"]).inc()
+                raise HTTPException(status_code=502, detail=f"vLLM вернул некорректные аргументы {call['name']}: {e}")
+            yield {"type": "tool_call", "id": call["id"], "name": call["name"], "arguments": call["parsed"]}
 
-        # 5) Делаем «второй» запрос в vLLM, чтобы сконкатенировать function_call + результат функции
-        #    и получить финальный текст.
+        # 4) Вызываем MCP server параллельно (не больше TOOL_CALLS_CONCURRENCY одновременно);
+        #    tool_result уходят клиенту в порядке готовности, в messages — в порядке вызовов
+        semaphore = asyncio.Semaphore(TOOL_CALLS_CONCURRENCY)
+
+        async def run_call(i: int, call: dict):
+            async with semaphore:
+                return i, await call_tool(call["name"], call["parsed"])
+
+        tasks = [asyncio.create_task(run_call(i, call)) for i, call in enumerate(calls)]
+        budget.tool_calls += len(calls)
+        results = [None] * len(calls)
+        try:
+            for next_done in asyncio.as_completed(tasks, timeout=budget.remaining_time()):
+                try:
+                    i, results[i] = await next_done
+                except asyncio.TimeoutError:
+                    raise BudgetExceeded("deadline")
+                yield {"type": "tool_result", "id": calls[i]["id"], "name": calls[i]["name"], "result": results[i]}
+        finally:
+            # ошибка одного вызова, конец бюджета или отключение клиента —
+            # остальные вызовы больше не нужны
+            for task in tasks:
+                task.cancel()
+            # забираем исключения отменённых и упавших вызовов, иначе asyncio пишет в лог
+            # "Task exception was never retrieved"
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        # 5) Делаем следующий запрос в vLLM: ход ассистента с tool_calls и по сообщению tool
+        #    на каждый вызов в том же порядке
         messages.append({
             "role": "assistant",
-            "content": f'{{"name": "{tool_name}", "arguments": "{func_args}"}}'
-        })
-        messages.append({
-            "role": "function",
-            "name": tool_name,
-            "content": json.dumps(tool_result)
+            "content": turn["content"] or None,
+            "tool_calls": [
+                {"id": call["id"], "type": "function", "function": {"name": call["name"], "arguments": call["arguments"] or "{}"}}
+                for call in calls
+            ],
         })
+        for call, result in zip(calls, results):
+            messages.append({
+                "role": "tool",
+                "tool_call_id": call["id"],
+                "name": call["name"],
+                "content": json.dumps(result)
+            })
         messages.append({
             "role": "user",
             "content": "Дай финальный ответ в виде цифры подразделения или вызови следующий инструмент в виде JSON"
         })
+
+
+async def ndjson_events(events):
+    """События построчно в NDJSON; ошибка после начала ответа приходит событием error —
+    любая, а не только HTTPException: иначе клиент увидит лишь оборванное соединение."""
+    try:
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+    except HTTPException as e:
+        yield json.dumps({"type": "error", "status": e.status_code, "detail": e.detail}, ensure_ascii=False) + "\n"
+    except Exception as e:
+        yield json.dumps({"type": "error", "status": 500, "detail": f"Ошибка сервера: {e}"}, ensure_ascii=False) + "\n"
+
+
+@app.post("/chat")
+async def chat_endpoint(request: ChatRequest):
+    """
+    Основной эндпоинт: принимает { prompt, tools? }, делает первый запрос в vLLM,
+    смотрит, есть ли function_call. Если он есть — дозванивается до MCP server
+    за результатом функции, затем отправляет второй запрос в vLLM, чтобы получить финальный
+    ответ. Возвращает MCP client’у JSON {"response": "..."}.
+    С "stream": true отдаёт application/x-ndjson — по событию на строку
+    (token, tool_call, tool_result, done или error) по мере их появления.
+    Без tools в запросе используется кэшированный каталог инструментов.
+    max_turns, deadline (секунды) и max_tokens ограничивают запрос; в ответе stop_reason
+    (finished или исчерпанный бюджет) и usage — сколько бюджета израсходовано.
+    priority (interactive по умолчанию) — класс при допуске к модели; при полной очереди — 429.
+    """
+    admission.admit(request.priority)
+    tools = request.tools if request.tools is not None else await cached_tools()
+    events = run_chat(request.prompt, tools, request.budget(), stream=request.stream)
+    if request.stream:
+        return StreamingResponse(ndjson_events(events), media_type="application/x-ndjson")
+
+    return await final_response(events)
+
+
+async def final_response(events) -> dict:
+    """{"response", "stop_reason", "usage"} из события done."""
+    async for event in events:
+        if event["type"] == "done":
+            return {k: v for k, v in event.items() if k != "type"}
+
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchChatRequest):
+    """
+    Пакетная обработка: принимает { prompts: [...], tools?, concurrency? } и прогоняет цикл
+    /chat для всех промптов, не больше concurrency одновременно. Ответ — application/x-ndjson,
+    по строке на промпт в порядке готовности: {"index": i, "response": "...", "stop_reason", "usage"} или
+    {"index": i, "status": ..., "error": "..."}; index — позиция промпта во входном списке.
+    По умолчанию идёт с priority batch и уступает интерактивным запросам.
+    """
+    concurrency = min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY)
+    admission.admit(request.priority, min(concurrency, len(request.prompts)))
+    tools = request.tools if request.tools is not None else await cached_tools()
+    return StreamingResponse(run_batch(request, tools, concurrency), media_type="application/x-ndjson")
+
+
+async def run_batch(request: BatchChatRequest, tools: list, concurrency: int):
+    prompts = request.prompts
+    batch_trace_id = current_trace_id()
+    pending = iter(enumerate(prompts))
+    results = asyncio.Queue()
+
+    async def worker():
+        # воркеры разбирают промпты по очереди: задач в памяти не больше concurrency
+        for i, prompt in pending:
+            # у каждого промпта пакета свой trace id: <trace id пакета>.<index>
+            trace_id_var.set(f"{batch_trace_id}.{i}")
+            try:
+                # бюджет у каждого промпта свой и отсчитывается с его начала
+                result = {"index": i, **await final_response(run_chat(prompt, tools, request.budget()))}
+            except HTTPException as e:
+                result = {"index": i, "status": e.status_code, "error": e.detail}
+            except Exception as e:
+                result = {"index": i, "status": 500, "error": repr(e)}
+            await results.put(result)
+
+    workers = [asyncio.create_task(worker()) for _ in range(max(1, min(concurrency, len(prompts))))]
+    try:
+        for _ in range(len(prompts)):
+            yield json.dumps(await results.get(), ensure_ascii=False) + "\n"
+    finally:
+        # клиент отключился — оставшиеся промпты не считаем
+        for task in workers:
+            task.cancel()
@@ -1,44 +1,127 @@
 # mcp_client.py
-from fastapi import FastAPI, HTTPException
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import requests
+import httpx
 import os
 
+from metrics import TraceMiddleware, inject_trace, metrics_endpoint
+
 # === Настройки ===
 LLM_SERVER_URL = os.getenv("LLM_SERVER_URL", "http://localhost:8022")
 
-app = FastAPI(title="MCP Client")
+# Таймауты к LLM server: соединение должно установиться быстро, а ответ /chat
+# (несколько ходов модели и вызовов инструментов) может идти долго
+CHAT_CONNECT_TIMEOUT = float(os.getenv("CHAT_CONNECT_TIMEOUT", "5"))
+CHAT_READ_TIMEOUT = float(os.getenv("CHAT_READ_TIMEOUT", "300"))
+CHAT_MAX_CONNECTIONS = int(os.getenv("CHAT_MAX_CONNECTIONS", "100"))
+# Как часто проверять, не отключился ли вызывающий, пока ждём /chat
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+# Общий асинхронный пул соединений к LLM server: медленный /chat не блокирует остальных
+llm_http = httpx.AsyncClient(
+    base_url=LLM_SERVER_URL,
+    timeout=httpx.Timeout(CHAT_READ_TIMEOUT, connect=CHAT_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=CHAT_MAX_CONNECTIONS, max_keepalive_connections=CHAT_MAX_CONNECTIONS),
+    event_hooks={"request": [inject_trace]},
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await llm_http.aclose()
+
+
+app = FastAPI(title="MCP Client", lifespan=lifespan)
+# trace id создаётся здесь (или приходит от вызывающего) и уходит в llm_server; метрики — на /metrics
+app.add_middleware(TraceMiddleware, service="mcp_client")
+app.add_route("/metrics", metrics_endpoint, methods=["GET"])
 
 
 class PromptRequest(BaseModel):
     prompt: str
+    # Пробросить поток событий LLM server (NDJSON) клиенту без буферизации
+    stream: bool = False
+
+
+async def cancel_on_disconnect(http_request: Request, coro):
+    """
+    Ждёт coro, пока вызывающий на связи. Если он отключился — запрос к LLM server
+    отменяется (соединение закрывается), а не досчитывается впустую.
+    """
+    task = asyncio.create_task(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Клиент отключился, запрос к LLM server отменён")
+    finally:
+        task.cancel()
+
+
+def chat_error(e: Exception) -> HTTPException:
+    if isinstance(e, httpx.TimeoutException):
+        return HTTPException(status_code=504, detail=f"LLM server не ответил вовремя: {e!r}")
+    if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+        # очередь к модели заполнена — вызывающий должен повторить позже, а не получить 500
+        return HTTPException(
+            status_code=429,
+            detail="LLM server перегружен, повторите запрос позже",
+            headers={"Retry-After": e.response.headers.get("Retry-After", "1")},
+        )
+    return HTTPException(status_code=500, detail=f"Ошибка при /chat у LLM server: {e}")
 
 
 @app.post("/process")
-async def process_prompt(request: PromptRequest):
+async def process_prompt(request: PromptRequest, http_request: Request):
     """
     Принимает JSON { "prompt": "..." },
-    отдаёт в LLM server (сначала get_tools, затем chat) и возвращает конечный ответ.
+    отдаёт в LLM server (/chat, каталог инструментов LLM server берёт из своего кэша)
+    и возвращает конечный ответ.
+    С "stream": true возвращает поток событий /chat как есть (application/x-ndjson).
     """
     prompt_text = request.prompt
 
-    try:
-        resp_tools = requests.get(f"{LLM_SERVER_URL}/get_tools", timeout=None)
-        resp_tools.raise_for_status()
-        tools_data = resp_tools.json()
-        tools_list = tools_data.get("tools", [])
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Не удалось получить tools у LLM server: {e}")
-
     payload = {
-        "prompt": prompt_text,
-        "tools": tools_list
+        "prompt": prompt_text
     }
-    try:
-        resp_chat = requests.post(f"{LLM_SERVER_URL}/chat", json=payload)
+    if request.stream:
+        payload["stream"] = True
+        try:
+            resp_chat = await llm_http.send(llm_http.build_request("POST", "/chat", json=payload), stream=True)
+            resp_chat.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            await e.response.aclose()
+            raise chat_error(e)
+        except Exception as e:
+            raise chat_error(e)
+
+        async def passthrough():
+            # при отключении вызывающего StreamingResponse закрывает генератор,
+            # а с ним и соединение к LLM server
+            try:
+                async for chunk in resp_chat.aiter_raw():
+                    yield chunk
+            finally:
+                await resp_chat.aclose()
+
+        return StreamingResponse(passthrough(), media_type="application/x-ndjson")
+
+    async def chat():
+        resp_chat = await llm_http.post("/chat", json=payload)
         resp_chat.raise_for_status()
-        chat_data = resp_chat.json()
+        return resp_chat.json()
+
+    try:
+        chat_data = await cancel_on_disconnect(http_request, chat())
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка при /chat у LLM server: {e}")
+        raise chat_error(e)
 
     return {"response": chat_data["response"]}
@@ -2,6 +2,8 @@ from typing import List, Dict
 import sqlite3
 from mcp.server.fastmcp import FastMCP
 
+from metrics import TraceMiddleware, instrument_fastmcp, metrics_endpoint
+
 mcp = FastMCP("documents")
 
 DB_PATH = "db_create/documents.db"
@@ -74,6 +76,14 @@ def search_document(doc_number: int, query: str) -> List[Dict[str, str]]:
 
 
 
+# Метрики Prometheus (tool_call_seconds, http_request_seconds) и trace id от llm_server
+mcp.custom_route("/metrics", methods=["GET"])(metrics_endpoint)
+instrument_fastmcp(mcp, "mcp_server")
+
+# ASGI-приложение для запуска через uvicorn (start_MCP.sh): uvicorn mcp_server:app
+app = mcp.sse_app()
+app.add_middleware(TraceMiddleware, service="mcp_server")
+
 if __name__ == "__main__":
 
     mcp.run()
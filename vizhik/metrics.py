@@ -0,0 +1,159 @@
+"""
+Общие метрики Prometheus и сквозной trace id для mcp_client, llm_server и mcp_server.
+
+Каждый сервис вешает TraceMiddleware и маршрут /metrics. Trace id приходит в заголовке
+X-Trace-Id (или создаётся на первом сервисе), живёт в contextvar на время запроса,
+уходит дальше через event hook inject_trace у httpx-клиентов и возвращается в ответе.
+Этапы запроса (HTTP, ход модели, вызов инструмента) пишутся в лог "trace" строками JSON
+с trace_id — по ним собирается таймлайн одного промпта из логов всех трёх сервисов.
+"""
+import contextvars
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Optional
+
+import httpx
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from starlette.requests import Request
+from starlette.responses import Response
+
+TRACE_HEADER = "X-Trace-Id"
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+# таймлайн пишется в stderr рядом с логами uvicorn (mcp_server.log, llm_server.log, mcp_client.log);
+# TRACE_LOG_LEVEL=WARNING отключает его
+logger = logging.getLogger("trace")
+logger.setLevel(os.getenv("TRACE_LOG_LEVEL", "INFO"))
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+    logger.propagate = False
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKENS = (16, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+HTTP_LATENCY = Histogram(
+    "http_request_seconds", "Длительность HTTP-запроса к сервису", ["service", "method", "path", "status"],
+    buckets=SECONDS,
+)
+LLM_LATENCY = Histogram("llm_turn_seconds", "Длительность одного хода модели", buckets=SECONDS)
+LLM_TTFT = Histogram("llm_time_to_first_token_seconds", "Время до первого токена хода модели", buckets=SECONDS)
+LLM_PROMPT_TOKENS = Histogram("llm_prompt_tokens", "Токенов промпта за ход модели", buckets=TOKENS)
+LLM_COMPLETION_TOKENS = Histogram("llm_completion_tokens", "Сгенерированных токенов за ход модели", buckets=TOKENS)
+TOOL_LATENCY = Histogram(
+    "tool_call_seconds", "Длительность вызова инструмента", ["service", "tool"], buckets=SECONDS,
+)
+TOOL_ERRORS = Counter("tool_call_errors_total", "Вызовы инструментов, завершившиеся ошибкой", ["service", "tool"])
+CHAT_TURNS = Histogram("chat_turns", "Ходов модели на один запрос", buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30))
+CHAT_REQUESTS = Counter("chat_requests_total", "Завершённые запросы к модели", ["stop_reason"])
+LLM_INFLIGHT = Gauge("llm_inflight", "Вызовов модели, выполняющихся сейчас")
+LLM_QUEUE_DEPTH = Gauge("llm_queue_depth", "Вызовов модели в очереди на допуск", ["priority"])
+LLM_QUEUE_WAIT = Histogram(
+    "llm_queue_wait_seconds", "Ожидание допуска к модели", ["priority"], buckets=(0,) + SECONDS,
+)
+LLM_REJECTED = Counter("llm_admission_rejected_total", "Запросы, отклонённые с 429 из-за полной очереди", ["priority"])
+
+
+def current_trace_id() -> Optional[str]:
+    return trace_id_var.get()
+
+
+async def inject_trace(request: httpx.Request) -> None:
+    """Event hook httpx: передаёт trace id текущего запроса следующему сервису."""
+    trace_id = trace_id_var.get()
+    if trace_id and TRACE_HEADER not in request.headers:
+        request.headers[TRACE_HEADER] = trace_id
+
+
+def log_stage(service: str, stage: str, started: float, **fields) -> None:
+    """Запись таймлайна: этап stage сервиса service, начавшийся в started (time.time())."""
+    logger.info(json.dumps({
+        "trace_id": trace_id_var.get(),
+        "service": service,
+        "stage": stage,
+        "start": round(started, 6),
+        "duration": round(time.time() - started, 6),
+        **fields,
+    }, ensure_ascii=False, default=str))
+
+
+def route_path(scope) -> str:
+    """Шаблон маршрута для метки path: /1c/receipts/{rid}, а не /1c/receipts/17."""
+    route = scope.get("route")  # FastAPI сохраняет маршрут в scope
+    if getattr(route, "path", None):
+        return route.path
+    # Starlette оставляет только path_params — подставляем имена параметров обратно
+    path = scope["path"]
+    for name, value in scope.get("path_params", {}).items():
+        path = path.replace(f"/{value}", f"/{{{name}}}", 1)
+    return path
+
+
+class TraceMiddleware:
+    """ASGI middleware: trace id из X-Trace-Id или новый, заголовок в ответе и http_request_seconds."""
+
+    def __init__(self, app, service: str):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        trace_id = headers.get(TRACE_HEADER.lower().encode(), b"").decode() or uuid.uuid4().hex
+        token = trace_id_var.set(trace_id)
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (TRACE_HEADER.encode(), trace_id.encode())]
+            await send(message)
+
+        started, wall = time.perf_counter(), time.time()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            HTTP_LATENCY.labels(self.service, scope["method"], route_path(scope), str(status)).observe(
+                time.perf_counter() - started
+            )
+            log_stage(self.service, "http", wall, method=scope["method"], path=scope["path"], status=status)
+            trace_id_var.reset(token)
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def instrument_fastmcp(mcp, service: str = "mcp_server") -> None:
+    """
+    Замеряет каждый вызов инструмента FastMCP (tool_call_seconds, tool_call_errors_total).
+    Инструменты выполняются в задаче MCP-сессии, а не HTTP-запроса, поэтому trace id
+    берётся из заголовков запроса, доставившего вызов (context.request_context.request).
+    """
+    manager = mcp._tool_manager
+    call_tool = manager.call_tool
+
+    async def timed_call_tool(name, arguments, context=None, convert_result=False):
+        request = None
+        if context is not None:
+            try:
+                request = context.request_context.request
+            except ValueError:
+                pass
+        trace_id = request.headers.get(TRACE_HEADER) if request is not None else None
+        token = trace_id_var.set(trace_id or trace_id_var.get())
+        started, wall = time.perf_counter(), time.time()
+        try:
+            return await call_tool(name, arguments, context=context, convert_result=convert_result)
+        except Exception:
+            TOOL_ERRORS.labels(service, name).inc()
+            raise
+        finally:
+            TOOL_LATENCY.labels(service, name).observe(time.perf_counter() - started)
+            log_stage(service, "tool", wall, tool=name)
+            trace_id_var.reset(token)
+
+    manager.call_tool = timed_call_tool